@@ -13,53 +13,224 @@ from crypt import crypt
 import hashlib
 import os
 from pwd import getpwnam
-from spwd import getspnam
+from spwd import getspall
+import sqlite3
 from subprocess import call
+from threading import Lock, local
+from time import time
+
+from werkzeug.security import safe_str_cmp
 
 from config import Config
 
 
-def authenticate(username, password):
+class ShadowCache(object):
+    """Cache of shadow entries, username -> encrypted password. All entries
+    are loaded at once by `load()`, so that a burst of logins reads the
+    shadow database only once. The entries are reloaded when the file at
+    `path` is modified, or when they are older than `ttl` seconds.
+    """
+
+    def __init__(self, load, path, ttl):
+        self.load = load
+        self.path = path
+        self.ttl = ttl
+        self.loads = 0
+        self.hits = 0
+        self._entries = None
+        self._stamp = None
+        self._loaded = 0
+        self._lock = Lock()
+
+    def get(self, username):
+        """Returns the encrypted password of `username`, or None."""
+        stamp = _get_mtime(self.path)
+        with self._lock:
+            if self._entries is None or self._stamp != stamp or \
+                    time() - self._loaded > self.ttl:
+                self._entries = self.load()
+                self._stamp = stamp
+                self._loaded = time()
+                self.loads += 1
+            else:
+                self.hits += 1
+            return self._entries.get(username)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries = None
+
+    def stats(self):
+        with self._lock:
+            return {'users': len(self._entries or ()),
+                    'loads': self.loads,
+                    'hits': self.hits}
+
+
+def _load_shadow():
+    # Entries are empty if koshinuke app is not permitted
+    # to access shadow password database.
+    return dict((entry.sp_nam, entry.sp_pwd) for entry in getspall())
+
+
+def _get_mtime(path):
     try:
-        encrypted_password = getspnam(username)[1]
-    except KeyError:
-        # User is not existed, or koshinuke app is not permitted
-        # to access shadow password database.
-        return False
-    hashed_pass = hashlib.sha1()
-    hashed_pass.update(password + encrypted_password[:40])
-    return encrypted_password[40:] == hashed_pass.hexdigest()
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def authenticate(username, password):
+    return _backend.authenticate(username, password)
 
 
 def add_user(username, password, auth_key):
-    """Add linux user, and register auth key to authorized_keys.
-    sudo is required, and it should be not used by web app.
+    """Add user, and register auth key. For the system backend, sudo is
+    required, and it should be not used by web app.
     """
-    home_dir = os.path.join('/home', '{0}'.format(username))  # fixme
-    call(['useradd',
-          '--password', _generate_encrypted_password(password),
-          '--home-dir', home_dir, '--create-home',
-          '--groups', Config.USER_GROUP,
-          '--shell', '/bin/bash',
-          username])
-    try:
-        uid, gid = getpwnam(username)[2:4]
-    except KeyError:
-        raise PermissionError("User is can not be created. "\
-                              "Maybe, permission denied.")
-    ssh_dir = os.path.join(home_dir, '.ssh')
-    os.mkdir(ssh_dir)
-    auth_key_file = os.path.join(ssh_dir, 'authorized_keys')
-    with open(auth_key_file, 'w') as f:
-        f.write(auth_key)
-    os.chown(auth_key_file, uid, gid)
-    os.chmod(auth_key_file, 0600)
-    os.chown(ssh_dir, uid, gid)
-    os.chmod(ssh_dir, 0700)
+    _backend.add_user(username, password, auth_key)
+
+
+def add_users(users):
+    """Add users at once, `users` is an iterable of
+    (username, password, auth_key).
+    """
+    _backend.add_users(users)
 
 
 def remove_user(username):
-    call(['userdel', '--remove', username])
+    _backend.remove_user(username)
+
+
+def get_stats():
+    return _backend.stats()
+
+
+def create_backend(kind, path=None):
+    """Returns the backend of users, `kind` is one of 'system' (linux users)
+    and 'database' (users in the sqlite database `path`).
+    """
+    if kind == 'system':
+        return SystemBackend(ShadowCache(_load_shadow, Config.SHADOW_PATH,
+                                         Config.SHADOW_CACHE_TTL))
+    elif kind == 'database':
+        return DatabaseBackend(path)
+    raise ValueError("unknown auth backend: {0}".format(kind))
+
+
+class SystemBackend(object):
+    """Users of linux, whose passwords are looked up through `cache`."""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def authenticate(self, username, password):
+        # None if user is not existed, or koshinuke app is not permitted
+        # to access shadow password database.
+        return _check_password(password, self.cache.get(username))
+
+    def add_user(self, username, password, auth_key):
+        """Add linux user, and register auth key to authorized_keys."""
+        home_dir = os.path.join('/home', '{0}'.format(username))  # fixme
+        call(['useradd',
+              '--password', _generate_encrypted_password(password),
+              '--home-dir', home_dir, '--create-home',
+              '--groups', Config.USER_GROUP,
+              '--shell', '/bin/bash',
+              username])
+        self.cache.invalidate()
+        try:
+            uid, gid = getpwnam(username)[2:4]
+        except KeyError:
+            raise PermissionError("User is can not be created. "\
+                                  "Maybe, permission denied.")
+        ssh_dir = os.path.join(home_dir, '.ssh')
+        os.mkdir(ssh_dir)
+        auth_key_file = os.path.join(ssh_dir, 'authorized_keys')
+        with open(auth_key_file, 'w') as f:
+            f.write(auth_key)
+        os.chown(auth_key_file, uid, gid)
+        os.chmod(auth_key_file, 0600)
+        os.chown(ssh_dir, uid, gid)
+        os.chmod(ssh_dir, 0700)
+
+    def add_users(self, users):
+        for username, password, auth_key in users:
+            self.add_user(username, password, auth_key)
+
+    def remove_user(self, username):
+        call(['userdel', '--remove', username])
+        self.cache.invalidate()
+
+    def stats(self):
+        return self.cache.stats()
+
+
+class DatabaseBackend(object):
+    """Users in the sqlite database `path`, which are not linux users.
+    Users are looked up by the primary key, and each thread keeps its own
+    connection, so that the statements compiled by sqlite are reused.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = local()
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS users ('
+                         'username TEXT PRIMARY KEY, '
+                         'password TEXT NOT NULL, auth_key TEXT)')
+
+    def authenticate(self, username, password):
+        row = self._connect().execute(
+            'SELECT password FROM users WHERE username = ?',
+            (username,)).fetchone()
+        return _check_password(password, row[0] if row else None)
+
+    def add_user(self, username, password, auth_key):
+        self.add_users([(username, password, auth_key)])
+
+    def add_users(self, users):
+        """Add users in a single transaction, none of them is added if one
+        of them already exists.
+        """
+        rows = ((username, _generate_encrypted_password(password), auth_key)
+                for username, password, auth_key in users)
+        try:
+            with self._connect() as conn:
+                conn.executemany('INSERT INTO users VALUES (?, ?, ?)', rows)
+        except sqlite3.IntegrityError as e:
+            raise UserExistsError("User already exists: {0}".format(e))
+
+    def remove_user(self, username):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM users WHERE username = ?', (username,))
+
+    def stats(self):
+        return {'users': self._connect().execute(
+            'SELECT COUNT(*) FROM users').fetchone()[0]}
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30)
+        return conn
+
+
+_backend = create_backend(Config.AUTH_BACKEND, Config.AUTH_DB_PATH)
+
+
+def _check_password(password, encrypted_password):
+    if encrypted_password is None:
+        return False
+    if isinstance(password, unicode):
+        password = password.encode('utf-8')
+    encrypted_password = str(encrypted_password)
+    hashed_pass = hashlib.sha1()
+    hashed_pass.update(password + encrypted_password[:40])
+    return safe_str_cmp(encrypted_password[40:], hashed_pass.hexdigest())
 
 
 def _generate_encrypted_password(password):
@@ -84,3 +255,7 @@ def _generate_encrypted_password(password):
 
 class PermissionError(Exception):
     pass
+
+
+class UserExistsError(Exception):
+    pass
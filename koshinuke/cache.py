@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+    koshinuke.cache
+    ~~~~~~~~~~~~~~~
+
+    Implements caches of the data computed from repositories.
+
+    :copyright: (c) 2012 lanius
+    :license: Apache License, Version 2.0, see LICENSE for more details.
+"""
+
+from collections import OrderedDict
+from hashlib import sha1
+import os
+from tempfile import NamedTemporaryFile
+from threading import Lock
+import zlib
+
+
+_LOW_WATER = 0.9  # fraction of max_size which a DiskCache is evicted to
+
+
+class DiskCache(object):
+    """Size-bounded cache of compressed data in the directory `root`. When
+    the total size exceeds `max_size` bytes, the least recently used
+    entries are removed until it is reduced to 90% of `max_size`. Entries
+    are files whose mtime is updated on every hit, so that processes can
+    share the cache.
+
+    The total size is counted up as entries are written, and the directory
+    is scanned only on the first write and when the count exceeds the
+    limit, when the entries written by other processes are counted too.
+    """
+
+    def __init__(self, root, max_size):
+        self.root = root
+        self.max_size = max_size
+        self.scans = 0
+        self._size = None  # total size, unknown until the first scan
+        self._lock = Lock()
+
+    def get(self, key):
+        compressed = self.get_compressed(key)
+        try:
+            return zlib.decompress(compressed) if compressed else None
+        except zlib.error:
+            return None
+
+    def set(self, key, data):
+        self.set_compressed(key, zlib.compress(data))
+
+    def get_compressed(self, key):
+        """Returns the data of `key` as it is stored, compressed by zlib."""
+        path = self._get_path(key)
+        try:
+            with open(path, 'rb') as f:
+                compressed = f.read()
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+        return compressed
+
+    def set_compressed(self, key, compressed):
+        """Stores the data of `key`, which is already compressed by zlib."""
+        path = self._get_path(key)
+        try:
+            old_size = os.stat(path).st_size
+        except OSError:  # not cached yet
+            old_size = 0
+        with _replace(path, 'wb') as f:
+            f.write(compressed)
+        with self._lock:
+            if self._size is not None:
+                self._size += len(compressed) - old_size
+            if self._size is None or self._size > self.max_size:
+                self._evict()
+
+    def stats(self):
+        with self._lock:
+            return {'size': self._size,
+                    'capacity': self.max_size,
+                    'scans': self.scans}
+
+    def _get_path(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        digest = sha1(key).hexdigest()
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def _evict(self):
+        self.scans += 1
+        entries = []
+        total = 0
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:  # removed by another process
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        if total > self.max_size:
+            entries.sort()
+            for _, size, path in entries:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+                if total <= self.max_size * _LOW_WATER:
+                    break
+        self._size = total
+
+
+class LRUCache(object):
+    """Cache of at most `size` objects in memory. The least recently used
+    object is removed when the cache is full.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            hit_rate = float(self.hits) / lookups if lookups else None
+            return {'entries': len(self._entries),
+                    'capacity': self.size,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': hit_rate}
+
+
+class MemoryCache(object):
+    """Size-bounded cache of compressed data in memory. When the total size
+    exceeds `max_size` bytes, the least recently used entries are removed,
+    and are moved to the DiskCache `spill` if it is given.
+    """
+
+    def __init__(self, max_size, spill=None):
+        self.max_size = max_size
+        self.spill = spill
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> compressed data
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            compressed = self._entries.pop(key, None)
+            if compressed is not None:
+                self.hits += 1
+                self._entries[key] = compressed
+                return zlib.decompress(compressed)
+        compressed = self.spill.get_compressed(key) if self.spill else None
+        with self._lock:
+            if compressed is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if compressed is None:
+            return None
+        self._add(key, compressed)
+        return zlib.decompress(compressed)
+
+    def set(self, key, data):
+        self._add(key, zlib.compress(data))
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'size': self.size,
+                    'capacity': self.max_size,
+                    'hits': self.hits,
+                    'misses': self.misses}
+
+    def _add(self, key, compressed):
+        evicted = []
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = compressed
+            self.size += len(compressed)
+            while self.size > self.max_size and self._entries:
+                evicted.append(self._entries.popitem(last=False))
+                self.size -= len(evicted[-1][1])
+        if self.spill:  # the spill scans only when it is full
+            for k, v in evicted:
+                self.spill.set_compressed(k, v)
+
+
+class _replace(object):
+    """Context manager of a temporary file which replaces `path` atomically
+    when closed, so that concurrent readers never see a partially written
+    file.
+    """
+
+    def __init__(self, path, mode='w'):
+        self.path = path
+        self.mode = mode
+
+    def __enter__(self):
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:  # created by another process
+                pass
+        self.file = NamedTemporaryFile(self.mode, dir=directory, delete=False)
+        return self.file
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+        if exc_type is None:
+            os.rename(self.file.name, self.path)
+        else:
+            os.remove(self.file.name)
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+    koshinuke.catfile
+    ~~~~~~~~~~~~~~~~~
+
+    Implements the pool of `git cat-file` processes reading objects.
+
+    :copyright: (c) 2012 lanius
+    :license: Apache License, Version 2.0, see LICENSE for more details.
+"""
+
+import os
+from subprocess import Popen, PIPE
+from threading import Lock, Thread
+from time import sleep, time
+
+
+_CHUNK_SIZE = 64 * 1024
+
+
+class CatFile(object):
+    """A long-lived `git cat-file --batch` process of a repository, or
+    `git cat-file --batch-check` one if `check` is True.
+    """
+
+    def __init__(self, path, check=False):
+        self.path = path
+        self.check = check
+        self.last_used = time()
+        option = '--batch-check' if check else '--batch'
+        with open(os.devnull, 'w') as devnull:
+            self._process = Popen(['git', '--git-dir', path,
+                                   'cat-file', option],
+                                  stdin=PIPE, stdout=PIPE, stderr=devnull)
+
+    def header(self, rev):
+        """Requests the object `rev`, and returns its hexsha, type and size.
+        Raises KeyError if the object does not exist. The content follows
+        the header unless the process is `check` one.
+        """
+        if isinstance(rev, unicode):
+            rev = rev.encode('utf-8')
+        if '\n' in rev:
+            raise KeyError(rev)
+        self.last_used = time()
+        self._process.stdin.write(rev + '\n')
+        self._process.stdin.flush()
+        line = self._process.stdout.readline()
+        if not line:
+            raise IOError("cat-file exited: {0}".format(self.path))
+        fields = line.split()
+        if len(fields) != 3:  # '<rev> missing' or '<rev> ambiguous'
+            raise KeyError(rev)
+        return fields[0], fields[1], int(fields[2])
+
+    def chunks(self, size, chunk_size=_CHUNK_SIZE):
+        """Yields the content of the requested object by chunks."""
+        stdout = self._process.stdout
+        while size > 0:
+            chunk = stdout.read(min(size, chunk_size))
+            if not chunk:
+                raise IOError("cat-file exited: {0}".format(self.path))
+            size -= len(chunk)
+            yield chunk
+        stdout.read(1)  # newline terminating the content
+
+    def alive(self):
+        return self._process.poll() is None
+
+    def close(self):
+        """Shuts down the process. Its stdout is closed as well as stdin, so
+        that a process blocked on writing an unread content exits.
+        """
+        if self.alive():
+            for f in [self._process.stdin, self._process.stdout]:
+                try:
+                    f.close()
+                except IOError:
+                    pass
+            self._process.wait()
+
+
+class CatFilePool(object):
+    """Pool of `git cat-file` processes, at most `size` idle processes per
+    repository. A process which failed is restarted, and a process which
+    has been idle for `idle_timeout` seconds is shut down.
+    """
+
+    def __init__(self, size, idle_timeout):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.started = 0
+        self.reused = 0
+        self.restarted = 0
+        self._idle = {}  # (path, check) -> list of CatFile
+        self._lock = Lock()
+        self._reaper = None
+
+    def info(self, path, rev):
+        """Returns hexsha, type and size of the object."""
+        return self._call(path, rev, True, lambda worker, header: header)
+
+    def read(self, path, rev):
+        """Returns hexsha, type and content of the object."""
+        def read(worker, header):
+            hexsha, objtype, size = header
+            return hexsha, objtype, ''.join(worker.chunks(size))
+        return self._call(path, rev, False, read)
+
+    def stream(self, path, rev, chunk_size=_CHUNK_SIZE):
+        """Returns hexsha, type, size of the object, and an iterator of its
+        content. The process is occupied until the iterator is exhausted,
+        and is shut down if the iterator is closed halfway.
+        """
+        worker = self._acquire(path, False)
+        try:
+            hexsha, objtype, size = worker.header(rev)
+        except KeyError:
+            self._release(worker)
+            raise
+        except (IOError, OSError):
+            worker.close()
+            raise
+
+        def chunks():
+            completed = False
+            try:
+                for chunk in worker.chunks(size, chunk_size):
+                    yield chunk
+                completed = True
+            finally:
+                if completed:
+                    self._release(worker)
+                else:
+                    worker.close()
+        return hexsha, objtype, size, chunks()
+
+    def stats(self):
+        with self._lock:
+            idle = sum(len(workers) for workers in self._idle.itervalues())
+        return {'idle': idle,
+                'started': self.started,
+                'reused': self.reused,
+                'restarted': self.restarted}
+
+    def close(self):
+        with self._lock:
+            workers = [w for ws in self._idle.itervalues() for w in ws]
+            self._idle.clear()
+        for worker in workers:
+            worker.close()
+
+    def _call(self, path, rev, check, f):
+        worker = self._acquire(path, check)
+        try:
+            result = f(worker, worker.header(rev))
+        except KeyError:
+            self._release(worker)
+            raise
+        except (IOError, OSError):  # broken process, retry once
+            worker.close()
+            self.restarted += 1
+            worker = self._acquire(path, check, reuse=False)
+            try:
+                result = f(worker, worker.header(rev))
+            except KeyError:
+                self._release(worker)
+                raise
+            except (IOError, OSError):
+                worker.close()
+                raise
+        self._release(worker)
+        return result
+
+    def _acquire(self, path, check, reuse=True):
+        with self._lock:
+            workers = self._idle.get((path, check))
+            while reuse and workers:
+                worker = workers.pop()
+                if worker.alive():
+                    self.reused += 1
+                    return worker
+            self.started += 1
+            if self._reaper is None:
+                self._reaper = Thread(target=self._reap)
+                self._reaper.daemon = True
+                self._reaper.start()
+        return CatFile(path, check)
+
+    def _release(self, worker):
+        with self._lock:
+            workers = self._idle.setdefault((worker.path, worker.check), [])
+            if len(workers) < self.size:
+                workers.append(worker)
+                return
+        worker.close()
+
+    def _reap(self):
+        while True:
+            sleep(self.idle_timeout)
+            expired = []
+            deadline = time() - self.idle_timeout
+            with self._lock:
+                for key, workers in self._idle.items():
+                    expired.extend(w for w in workers
+                                   if w.last_used < deadline)
+                    workers[:] = [w for w in workers
+                                  if w.last_used >= deadline]
+                    if not workers:
+                        del self._idle[key]
+            for worker in expired:
+                worker.close()
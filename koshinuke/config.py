@@ -9,22 +9,77 @@
     :license: Apache License, Version 2.0, see LICENSE for more details.
 """
 
+import os
 import socket
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from time import time
 import urllib2
 
 
 # helper functions
 def find_host(is_public):
     if is_public:
-        ip = urllib2.urlopen('http://ipcheck.ieserver.net').read()
+        ip = urllib2.urlopen('http://ipcheck.ieserver.net', timeout=10).read()
         return socket.gethostbyaddr(ip)[0]
     else:
         return socket.gethostname()
 
 
+class LazyHost(object):
+    """Host name found by find_host on first use, instead of on import. The
+    environment variable KOSHINUKE_HOST overrides it. A found name is kept
+    in the file 'host' of CACHE_ROOT for HOST_CACHE_TTL seconds, so that it
+    is not found again on every start. If the public host can not be found,
+    e.g. offline, the local host name is used and not kept.
+    """
+
+    def __init__(self, is_public):
+        self.is_public = is_public
+        self._host = None
+        self._lock = Lock()
+
+    def __get__(self, obj, config):
+        with self._lock:
+            if self._host is None:
+                self._host = self._find(config)
+            return self._host
+
+    def _find(self, config):
+        host = os.environ.get('KOSHINUKE_HOST')
+        if host:
+            return host
+        path = os.path.join(config.CACHE_ROOT, 'host')
+        try:
+            if time() - os.stat(path).st_mtime < config.HOST_CACHE_TTL:
+                with open(path) as f:
+                    host = f.read().strip()
+        except (IOError, OSError):  # not kept yet
+            pass
+        if host:
+            return host
+        try:
+            host = find_host(self.is_public)
+        except (IOError, socket.error):  # offline
+            return find_host(is_public=False)
+        try:
+            with NamedTemporaryFile('w', dir=config.CACHE_ROOT,
+                                    delete=False) as f:
+                f.write(host)
+            os.rename(f.name, path)
+        except (IOError, OSError):  # CACHE_ROOT is not writable
+            pass
+        return host
+
+
 # configurations
 class BaseConfig(object):
     USER_GROUP = 'knusers'
+    HOST_CACHE_TTL = 24 * 60 * 60
+    AUTH_BACKEND = 'system'  # 'system' or 'database'
+    AUTH_DB_PATH = None
+    SHADOW_PATH = '/etc/shadow'
+    SHADOW_CACHE_TTL = 60
 
     CREATE_MESSAGE = "create repository."
     DEFAULT_COMMIT_MESSAGE = "updated by koshinuke."
@@ -32,6 +87,28 @@ class BaseConfig(object):
 
     EXCLUDED_PROJECTS = ['bin', 'lib', 'lib64', 'usr']
 
+    REPO_POOL_SIZE = 64
+    CATFILE_POOL_SIZE = 4
+    CATFILE_IDLE_TIMEOUT = 60
+    BLAME_CACHE_SIZE = 64 * 1024 * 1024
+    LASTCOMMIT_CACHE_SIZE = 64 * 1024 * 1024
+    HISTORY_CACHE_SIZE = 16 * 1024 * 1024
+    COMMIT_CACHE_SIZE = 100000
+    WRITER_IDLE_TIMEOUT = 60
+    SCAN_WORKERS = 4
+    CLONE_WORKERS = 2
+    PROVISION_WORKERS = 4
+    LOCAL_PROJECT = 'local'
+    MAX_PATCH_SIZE = 256 * 1024
+    MAX_DIFF_SIZE = 4 * 1024 * 1024
+    RESPONSE_CACHE_SIZE = 32 * 1024 * 1024
+    RESPONSE_CACHE_DISK_SIZE = 256 * 1024 * 1024
+    IMMUTABLE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+    SESSION_STORE = 'memory'  # 'memory', 'file' or 'sqlite'
+    SESSION_PATH = None
+    SESSION_SWEEP_INTERVAL = 60 * 60
+
 
 class ProductionConfig(BaseConfig):
     HOST = '<hostname>'
@@ -41,6 +118,9 @@ class ProductionConfig(BaseConfig):
     SECRET_KEY = '<secret_key>'
 
     PROJECT_ROOT = '<koshinuke_project_root>'
+    CACHE_ROOT = '<koshinuke_cache_root>'
+    SESSION_STORE = 'sqlite'
+    SESSION_PATH = '<koshinuke_session_db>'
     SYSTEM_AUTHOR = '<system_author>'
     SYSTEM_MAILADDRESS = '<system_mailaddress>'
 
@@ -56,6 +136,7 @@ class DevelopmentConfig(BaseConfig):
     SECRET_KEY = 'koshinuke_default_secret_key'
 
     PROJECT_ROOT = '/var/koshinuke/'
+    CACHE_ROOT = '/var/cache/koshinuke/'
     SYSTEM_AUTHOR = 'koshinuke'
     SYSTEM_MAILADDRESS = 'koshinuke@example.com'
 
@@ -64,7 +145,7 @@ class DevelopmentConfig(BaseConfig):
 
 
 class AutoConfig(DevelopmentConfig):
-    HOST = find_host(is_public=True)
+    HOST = LazyHost(is_public=True)
     PORT = 80
 
 
@@ -9,28 +9,70 @@
     :license: Apache License, Version 2.0, see LICENSE for more details.
 """
 
-from base64 import b64encode
-from datetime import datetime, timedelta
+from base64 import b64encode, urlsafe_b64decode, urlsafe_b64encode
+from binascii import hexlify, unhexlify
+from collections import namedtuple
 from grp import getgrnam
-from itertools import chain
+from itertools import dropwhile, islice
+import json
 import os
 from pwd import getpwnam
 import re
 from shutil import rmtree
-from subprocess import call
-from tempfile import mkdtemp
-from time import mktime
+from stat import S_IMODE, S_ISDIR, S_ISLNK
+from subprocess import Popen, PIPE
+from time import altzone, daylight, localtime, time, timezone
 from urlparse import urlparse
 
-from git import Repo, NoSuchPathError, BadObject, GitCommandError
+from git import (Repo, NoSuchPathError, InvalidGitRepositoryError, BadObject,
+                 GitCommandError)
 
+from cache import DiskCache, LRUCache
+from catfile import CatFilePool
 from config import Config
+import diff
+import history
+from jobs import JobQueue
+import lastcommit
+from pool import RepoPool
+from refindex import RefIndex
+from writer import Edit, WriteQueues
 
 
 _EXCLUDED_PROJECTS = set(Config.EXCLUDED_PROJECTS)
 _IMAGE_EXTS = set(['.bmp', '.gif', '.png', '.jpg', '.jpeg', '.ico'])
 
-_BLAME_REGEXP = re.compile(r'\^?(.*) \(.*\) (.*)')
+_DIR_MODE = 02770  # setgid, so that entries inherit the group
+_SHARED_REPOSITORY = '0660'
+
+_PROGRESS_REGEXP = re.compile(r'(?:remote: )?([A-Za-z ]+): +(\d+)%')
+_BLAME_HEADER_REGEXP = re.compile(r'([0-9a-f]{40}) \d+ \d+( \d+)?$')
+_HUNK_HEADER_REGEXP = re.compile(r'@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+_repo_pool = RepoPool(Config.REPO_POOL_SIZE)
+_catfile_pool = CatFilePool(Config.CATFILE_POOL_SIZE,
+                            Config.CATFILE_IDLE_TIMEOUT)
+
+_jobs = JobQueue(Config.CLONE_WORKERS)
+
+_ref_index = RefIndex(lambda path: _load_refs(path), Config.SCAN_WORKERS)
+
+_write_queues = WriteQueues(lambda path, edits: _apply_edits(path, edits),
+                            Config.WRITER_IDLE_TIMEOUT)
+
+_commit_cache = LRUCache(Config.COMMIT_CACHE_SIZE)
+
+# blames and indexes of last commits are shared by repositories, since
+# they depend only on the commit
+_blame_cache = DiskCache(os.path.join(Config.CACHE_ROOT, 'blame'),
+                         Config.BLAME_CACHE_SIZE)
+_lastcommit_cache = DiskCache(os.path.join(Config.CACHE_ROOT, 'lastcommit'),
+                              Config.LASTCOMMIT_CACHE_SIZE)
+_history_cache = DiskCache(os.path.join(Config.CACHE_ROOT, 'history'),
+                           Config.HISTORY_CACHE_SIZE)
+
+_CommitInfo = namedtuple('_CommitInfo',
+                         'hexsha parents author committed_date message')
 
 
 def get_projects():
@@ -39,23 +81,46 @@ def get_projects():
 
 
 def get_repositories(project):
+    # other entries, such as temporary directories of clones, are skipped
     return [repo_dot_git[:-4]  # remove '.git'
-            for repo_dot_git in os.listdir(_get_project_path(project))]
+            for repo_dot_git in os.listdir(_get_project_path(project))
+            if repo_dot_git.endswith('.git')]
+
+
+def get_all_refs(limit=100, progress=None):
+    """Returns branches and tags of all repositories, the first `limit` of
+    each, from the index of refs. Only repositories whose refs have changed
+    since the last call are read, by Config.SCAN_WORKERS threads at once.
+    `progress(done, total, path, seconds)` is called for each of them.
+    """
+    return list(iter_all_refs(limit, progress))
+
+
+def iter_all_refs(limit=100, progress=None):
+    """Returns an iterator of the repositories of get_all_refs."""
+    snapshot = _ref_index.snapshot(Config.PROJECT_ROOT, _EXCLUDED_PROJECTS,
+                                   progress)
+    return ({'host': Config.HOST,
+             'name': repository,
+             'path': '/'.join([project, repository]),
+             'branches': refs['branches'][:limit],
+             'tags': refs['tags'][:limit]}
+            for project, repository, refs in snapshot)
 
 
 def get_history(project, repository, days=30):
-    now = datetime.today()
+    repo = _get_repo(project, repository)
+    branches = repo.branches
+    activities = history.get_activities(repo, branches, days,
+                                        counts_cache=_history_cache)
+    infos = [_get_commitinfo(repo, h.commit.hexsha) for h in branches]
     return [{'name': h.name,
              'path': h.name,
-             'timestamp': h.commit.committed_date,
-             'author': h.commit.author.name,
-             'message': h.commit.message,
-             'activities': [[int(mktime(
-                                 (now - timedelta(days=i)).timetuple())),
-                             h.commit.count(since='{0} days ago'.format(i + 1),
-                                            until='{0} days ago'.format(i))]
-                            for i in xrange(days)]}
-            for h in _get_repo(project, repository).branches]
+             'timestamp': c.committed_date,
+             'author': c.author,
+             'message': c.message,
+             'activities': a}
+            for h, c, a in zip(branches, infos, activities)]
 
 
 def get_resource(project, repository, rev, path):
@@ -64,193 +129,241 @@ def get_resource(project, repository, rev, path):
         blob = commit.tree[path]
     except KeyError:
         raise NotFoundError("path is not found: {0}".format(path))
+    data = _read_object(commit.repo, blob.hexsha)
+    info = _get_commitinfo(commit.repo, commit.hexsha)
     _, ext = os.path.splitext(path)
     if ext in _IMAGE_EXTS:  # content is image
-        encoded_data = b64encode(blob.data_stream.read())
+        encoded_data = b64encode(data)
         content = 'data:image/{0};base64,{1}'.format(ext, encoded_data)
     else:  # content is text
         try:
-            content = blob.data_stream.read().decode('utf-8')
+            content = data.decode('utf-8')
         except UnicodeDecodeError:
             raise NotFoundError("maybe, path specified tree: {0}".format(path))
     return {'objectid': blob.hexsha,
-            'author': commit.author.name,
-            'message': commit.message,
-            'timestamp': commit.committed_date,
+            'author': info.author,
+            'message': info.message,
+            'timestamp': info.committed_date,
             'content': content}
 
 
-def get_resources(project, repository, rev, path='', offset=0, limit=100):
+def get_blob(project, repository, rev, path):
+    commit = _get_commit(project, repository, rev)
+    try:
+        blob = commit.tree[path]
+    except KeyError:
+        raise NotFoundError("path is not found: {0}".format(path))
+    if blob.type != 'blob':
+        raise NotFoundError("path is not a blob: {0}".format(path))
+    _, _, size = _catfile_pool.info(commit.repo.git_dir, blob.hexsha)
+    return {'objectid': blob.hexsha, 'size': size}
+
+
+def iter_blob(project, repository, objectid, start=0, end=None):
+    """Returns an iterator of the content of the blob from `start` to `end`
+    (exclusive) by chunks. The blob is streamed from `git cat-file`, so the
+    whole content is never held in memory.
+    """
+    repo = _get_repo(project, repository)
+    try:
+        _, _, size, chunks = _catfile_pool.stream(repo.git_dir, objectid)
+    except KeyError:
+        raise NotFoundError("object is not found: {0}".format(objectid))
+    if end is None or end > size:
+        end = size
+    return _slice_chunks(chunks, start, end)
+
+
+def get_resources(project, repository, rev, path='', offset=0, limit=100,
+                  cursor=None):
     commit = _get_commit(project, repository, rev)
 
-    # get limited trees and blobs
-    if path and not path.endswith('/'):
-        path = ''.join([path, '/'])
-    if path:
-        def subtree(r):
-            if r.path.startswith(path):
-                return True
-            else:
-                return False
-    else:
-        def subtree(r):
-            return True
-    trees = {}
-    blobs = {}
-    for r in filter(subtree, commit.tree.traverse())[offset:offset + limit]:
+    # get limited trees and blobs in the directory
+    entries = iter(_get_tree(commit, path))
+    if cursor:
+        last = _decode_cursor('tree', cursor)
+        entries = dropwhile(lambda r: _entry_key(r) <= last, entries)
+        offset = 0
+    trees = []
+    blobs = []
+    for r in islice(entries, offset, offset + limit):
         if r.type == 'tree':
-            trees[r.path] = r
+            trees.append(r)
         else:
-            blobs[r.path] = r
+            blobs.append(r)
 
     # setup dictionary object
     result = [{'name': t.name,
                'path': '/'.join([rev, t.path]),
-               'children': len(t.blobs) + len(t.trees),
-               'type': 'tree'} for t in trees.values()]
-    if not commit.parents:
-        result.extend([_blobdata(b, commit, rev) for b in blobs.values()])
-    else:
-        for c in chain([commit], commit.iter_parents()):
-            if not blobs:
-                break
-            for changed_path in c.stats.files.keys():
-                b = blobs.pop(changed_path, None)
-                if b:  # there is changed_path in resouces
-                    result.append(_blobdata(b, c, rev))
+               'children': len(t),
+               'type': 'tree'} for t in trees]
+    if blobs:
+        last_commits = lastcommit.get_last_commits(commit, path,
+                                                   _lastcommit_cache)
+        infos = {}
+        for b in blobs:
+            hexsha = last_commits[b.name]
+            if not hexsha in infos:
+                infos[hexsha] = _get_commitinfo(commit.repo, hexsha)
+        blobdata = [_blobdata(b, infos[last_commits[b.name]], rev)
+                    for b in blobs]
+        blobdata.sort(key=lambda b: b['timestamp'], reverse=True)
+        result.extend(blobdata)
     return result
 
 
 def get_commits(project, repository, ref, rev=None, path='',
-                offset=0, limit=30):
+                offset=0, limit=30, cursor=None):
     commits = []
-    if rev:
+    if cursor:
+        child = _get_commit(project, repository,
+                            _decode_cursor('commits', cursor))
+        offset = 0
+    elif rev:
         child = _get_commit(project, repository, rev)
     else:
         child = _get_commit(project, repository, ref)
-        commits.append(_commitdata(child))
+        commits.append(_commitdata(child.repo, child.hexsha))
         limit -= 1
-    commits.extend([_commitdata(p) for p in child.iter_parents(
+    commits.extend([_commitdata(p.repo, p.hexsha) for p in child.iter_parents(
         paths=path, max_count=limit, skip=(offset + 1), first_parent=True)])
     return commits
 
 
 def get_commit(project, repository, rev):
+    """Returns the commit with its diffs against each parent. Patches are
+    limited by Config.MAX_PATCH_SIZE per file and Config.MAX_DIFF_SIZE in
+    total; contents of the files are served by get_commit_contents.
+    """
     commit = _get_commit(project, repository, rev)
     parents = commit.parents
+    budget = diff.Budget(Config.MAX_PATCH_SIZE, Config.MAX_DIFF_SIZE)
     diffs = []
-    for parent in parents:
-        # todo: since git 1.7.8, I can use --function-context option.
-        for d in commit.diff(parent, create_patch=True):
-            """Git-Python 0.3.2 RC1 has a bug, so diff.new_file is operation
-            'delete' and diff.deleted_file is operation 'add'."""
-            if d.new_file:
-                operation = 'delete'
-            elif d.deleted_file:
-                operation = 'add'
-            elif d.renamed:
-                operation = 'rename'
-            else:
-                operation = 'modify'
-            diff = {'newpath': d.a_blob.path,
-                    'oldpath': d.b_blob.path,
-                    'operation': operation,
-                    'patch': '\n'.join(d.diff.splitlines()[2:]).decode('utf-8')
-                    }
-            if operation == 'rename' or operation == 'modify':
-                diff.update({
-                    'newcontent': d.a_blob.data_stream.read().decode('utf-8'),
-                    'oldcontent': d.b_blob.data_stream.read().decode('utf-8')
-                    })
-            diffs.append(diff)
+    stats = None
+    for parent in (parents or [None]):
+        d = diff.get_diffs(commit.repo.git_dir,
+                           parent.hexsha if parent else None,
+                           commit.hexsha, budget)
+        if stats is None:  # stats are against the first parent
+            stats = diff.get_stats(d)
+        diffs.extend(d)
+    info = _get_commitinfo(commit.repo, commit.hexsha)
     return {'commit': rev, 'parents': [p.hexsha for p in parents],
-            'diff': diffs, 'stats': {'files': commit.stats.files,
-                                     'total': commit.stats.total},
-            'timestamp': commit.committed_date,
-            'author': commit.author.name,
-            'message': commit.message}
-
-
-def get_blame(project, repository, rev, path):
-    cloned_repository_path = mkdtemp()
-    repo = _get_repo(project, repository).clone(cloned_repository_path)
-    try:
-        repo.git.checkout('-b', rev, 'remotes/origin/{0}'.format(rev))
-    except GitCommandError:
-        pass  # branch already exists, maybe 'master'
+            'diff': diffs, 'stats': stats,
+            'truncated': any(d['truncated'] for d in diffs),
+            'timestamp': info.committed_date,
+            'author': info.author,
+            'message': info.message}
+
+
+def get_commit_contents(project, repository, rev, path, oldpath=None,
+                        parent=0):
+    """Returns the contents of the file `path` at the commit and `oldpath`
+    at its `parent`-th parent. A content is None if the file does not exist.
+    """
+    commit = _get_commit(project, repository, rev)
     try:
-        result = repo.git.blame(path, '-l')
-    except GitCommandError:
-        raise NotFoundError("path is invalid: {0}".format(path))
-    blame = []
-    for line in result.splitlines():
-        m = _BLAME_REGEXP.match(line)
-        c = repo.commit(m.group(1))
-        data = _commitdata(c)
-        data.update({'content': m.group(2)})
-        blame.append(data)
-    rmtree(cloned_repository_path)
-    return blame
+        parent = commit.parents[parent] if commit.parents else None
+    except IndexError:
+        raise NotFoundError("parent is not found: {0}".format(parent))
+    return {'newcontent': _get_content(commit, path),
+            'oldcontent': _get_content(parent, oldpath or path)}
 
 
-def get_branches(project, repository, offset=0, limit=100):
-    return _get_ref(project, repository, 'branches', offset, limit)
+def get_blame(project, repository, rev, path):
+    return list(iter_blame(project, repository, rev, path))
 
 
-def get_tags(project, repository, offset=0, limit=100):
-    return _get_ref(project, repository, 'tags', offset, limit)
+def iter_blame(project, repository, rev, path):
+    """Returns an iterator of the lines of get_blame. Errors are raised
+    when it is called, not while iterating.
+    """
+    commit = _get_commit(project, repository, rev)
+    lines = _get_blame_lines(project, repository, commit, path)
+
+    def iterate():
+        commits = {}  # hexsha -> commitdata, resolved once per commit
+        for hexsha, content in lines:
+            if not hexsha in commits:
+                commits[hexsha] = _commitdata(commit.repo, hexsha)
+            data = dict(commits[hexsha])
+            data['content'] = content
+            yield data
+    return iterate()
+
+
+def get_stats():
+    return {'repositories': _repo_pool.stats(),
+            'catfile': _catfile_pool.stats(),
+            'writes': _write_queues.stats(),
+            'refs': _ref_index.stats(),
+            'jobs': _jobs.stats(),
+            'commits': _commit_cache.stats(),
+            'blames': _blame_cache.stats(),
+            'lastcommits': _lastcommit_cache.stats(),
+            'history': _history_cache.stats()}
+
+
+def get_branches(project, repository, offset=0, limit=100, cursor=None):
+    return _get_ref(project, repository, 'branches', offset, limit, cursor)
+
+
+def get_tags(project, repository, offset=0, limit=100, cursor=None):
+    return _get_ref(project, repository, 'tags', offset, limit, cursor)
+
+
+def get_next_cursor(kind, resources):
+    """Returns an opaque cursor pointing to the page next to `resources`,
+    the result of get_resources ('tree'), get_commits ('commits'),
+    get_branches ('branches') or get_tags ('tags').
+    """
+    if kind == 'tree':
+        last = max(_entry_key(r) for r in resources)
+    elif kind == 'commits':
+        last = resources[-1]['commit']
+    else:
+        last = resources[kind][-1]['name']
+    return urlsafe_b64encode(json.dumps([kind, last]))
 
 
 def update_resource(project, repository, rev, path, content, message=None,
-                    objectid=None):
+                    objectid=None, coalesce=False):
+    repo = _get_repo(project, repository)
     if not objectid:
-        repo_is_empty = False
-        try:
-            _get_repo(project, repository).commit()
-        except ValueError:  # repository is empty
-            repo_is_empty = True
-        if not repo_is_empty:
+        if repo.branches:
             raise CanNotUpdateError("Repository is not empty. "
                                     "Specify objectid.")
     else:
-        if not rev in set([h.name for h
-                           in _get_repo(project, repository).branches]):
+        if not rev in set([h.name for h in repo.branches]):
             raise CanNotUpdateError("Specify a branch name for rev.")
+        parent = _get_commit(project, repository, rev)
         try:
-            blob = _get_commit(project, repository, rev).tree[path]
+            blob = parent.tree[path]
         except KeyError:
             raise CanNotUpdateError("Resource is not exist.")
         if objectid != blob.hexsha:
             raise CanNotUpdateError("Resource is already updated.")
-    cloned_repository_path = mkdtemp()
-    repo = _get_repo(project, repository).clone(cloned_repository_path)
-    try:
-        repo.git.checkout('-b', rev, 'remotes/origin/{0}'.format(rev))
-    except GitCommandError:
-        pass  # branch already exists, maybe 'master'
-    with open(os.path.join(cloned_repository_path, path), 'w') as f:
-        f.write(content.encode('utf-8'))
-    repo.git.add('-A')
-    try:
-        if not message:
-            message = Config.DEFAULT_COMMIT_MESSAGE
-        repo.git.commit('-m', '{0}'.format(message),
-                        '--author',
-                        '{0} <{1}>'.format(Config.SYSTEM_AUTHOR,
-                                           Config.SYSTEM_MAILADDRESS))
-        repo.git.push(_get_repository_path(project, repository), rev)
-    except Exception:
-        raise UnignorableError("Unexpected error. Debug is required.")
-    rmtree(cloned_repository_path)
+    if not message:
+        message = Config.DEFAULT_COMMIT_MESSAGE
+    edit = Edit(rev, path, content.encode('utf-8'), message, objectid,
+                coalesce)
+    _write_queues.submit(_get_repository_path(project, repository), edit)
 
 
 def create_repository(project, repository, username, readme=None):
     path = _get_repository_path(project, repository)
-    repo = Repo.init(path, bare=True)
+    if os.path.exists(path):
+        raise CanNotUpdateError("repository already exists: {0}/{1}".format(
+            project, repository))
+    repo = Repo.init(path, bare=True, shared=_SHARED_REPOSITORY)
     if not readme:
         readme = Config.DEFAULT_README
-    update_resource(project, repository, 'master', 'README', readme,
-                    Config.CREATE_MESSAGE)
+    # nobody writes to the new repository yet, so that the initial commit
+    # is written directly instead of through the write queue
+    edit = Edit('master', 'README', readme.encode('utf-8'),
+                Config.CREATE_MESSAGE, None)
+    _apply_edits(path, [edit])
+    edit.wait()
     _set_permission(path, username)
 
 
@@ -258,41 +371,94 @@ def create_project(project, username):
     path = _get_project_path(project)
     if os.path.exists(path):
         return
-    os.mkdir(path)
+    os.mkdir(path, _DIR_MODE)
+    _set_permission(path, username)
+
+
+def fix_permission(project, repository, username):
+    """Gives the repository to the user and Config.USER_GROUP, and lets the
+    group access every entry under it. This is only needed for repositories
+    created before permissions were set up by git. Returns the number of
+    entries changed.
+    """
+    path = _get_repository_path(project, repository)
+    if not os.path.isdir(path):
+        raise NotFoundError("repository is not found: {0}/{1}".format(
+            project, repository))
     _set_permission(path, username)
+    return _set_group_permission(path, getgrnam(Config.USER_GROUP)[2])
 
 
 def clone_remote_repository(repo_uri, repo_username, repo_password, username):
+    """Starts cloning the remote repository in background, and returns the
+    job, whose status is given by get_job. The project is named after the
+    host of `repo_uri`, or Config.LOCAL_PROJECT for a local one.
+    """
     # check: where project can i clone to?
     parsed = urlparse(repo_uri)
-    project = parsed.netloc
-    repository = parsed.path.split('/')[-1]
+    project = parsed.netloc or Config.LOCAL_PROJECT
+    repository = parsed.path.rstrip('/').split('/')[-1]
     if repository.endswith('.git'):
         repository = repository[:-4]
+    if not repository or repository.startswith('.'):
+        raise CanNotUpdateError("uri is invalid: {0}".format(repo_uri))
     path = _get_repository_path(project, repository)
+    if os.path.exists(path):
+        raise CanNotUpdateError("repository already exists: {0}".format(
+            '/'.join([project, repository])))
     create_project(project, username)
-    if parsed.scheme == 'git':
-        uri = ''.join([parsed.scheme, '://', parsed.netloc, parsed.path])
-    else:
+    if parsed.scheme in ('http', 'https') and repo_username:
         uri = ''.join([parsed.scheme, '://',
                        repo_username, ':', repo_password, '@',
                        parsed.netloc, parsed.path])
-    call(['git', 'clone', '--bare', uri, path])
-    _set_permission(path, username)
+    else:
+        uri = ''.join([parsed.scheme, '://', parsed.netloc, parsed.path])
+    job = _jobs.submit('clone', '/'.join([project, repository]),
+                       _clone, uri, repo_uri, path, username)
+    return job.to_dict()
 
 
-def _get_ref(project, repository, ref, offset=0, limit=100):
+def get_job(job_id):
+    job = _jobs.get(job_id)
+    if not job:
+        raise NotFoundError("job is not found: {0}".format(job_id))
+    return job.to_dict()
+
+
+def _get_ref(project, repository, ref, offset=0, limit=100, cursor=None):
+    repo = _get_repo(project, repository)
+    refs = sorted(repo.__getattribute__(ref), key=lambda r: r.name)
+    if cursor:
+        last = _decode_cursor(ref, cursor)
+        refs = dropwhile(lambda r: r.name <= last, refs)
+        offset = 0
     return {'host': Config.HOST,
             'name': repository,
             'path': '/'.join([project, repository]),
-            ref: [{'name': r.name,
-                   'path': r.name,
-                   'timestamp': r.commit.committed_date,
-                   'author': r.commit.author.name,
-                   'message': r.commit.message}
-                  for r in _get_repo(
-                      project, repository).__getattribute__(ref)[offset:limit]
-                  ]}
+            ref: [_refdata(repo, r)
+                  for r in islice(refs, offset, offset + limit)]}
+
+
+def _refdata(repo, ref):
+    info = _get_commitinfo(repo, ref.commit.hexsha)
+    return {'name': ref.name,
+            'path': ref.name,
+            'timestamp': info.committed_date,
+            'author': info.author,
+            'message': info.message}
+
+
+def _load_refs(path):
+    """Returns branches and tags of the repository at `path` sorted by name,
+    or None if it is not a repository.
+    """
+    try:
+        repo = _repo_pool.get(path)
+    except (InvalidGitRepositoryError, NoSuchPathError):
+        return None
+    return dict((ref, [_refdata(repo, r) for r in sorted(
+        repo.__getattribute__(ref), key=lambda r: r.name)])
+        for ref in ['branches', 'tags'])
 
 
 def _get_commit(project, repository, rev):
@@ -303,9 +469,22 @@ def _get_commit(project, repository, rev):
         raise NotFoundError("rev is invalid: {0}".format(rev))
 
 
+def _get_tree(commit, path):
+    path = path.strip('/')
+    if not path:
+        return commit.tree
+    try:
+        tree = commit.tree[path]
+    except KeyError:
+        raise NotFoundError("path is not found: {0}".format(path))
+    if tree.type != 'tree':
+        raise NotFoundError("path is not a tree: {0}".format(path))
+    return tree
+
+
 def _get_repo(project, repository):
     try:
-        return Repo(_get_repository_path(project, repository))
+        return _repo_pool.get(_get_repository_path(project, repository))
     except NoSuchPathError:
         raise NotFoundError("repository is not found: {0}".format(repository))
 
@@ -322,42 +501,462 @@ def _get_project_path(project):
     return path
 
 
-def _commitdata(commit):
-    return {'commit': commit.hexsha,
-            'parents': [c.hexsha for c in commit.parents],
-            'timestamp': commit.committed_date,
-            'author': commit.author.name,
-            'message': commit.message}
+def _slice_chunks(chunks, start, end):
+    position = 0
+    try:
+        for chunk in chunks:
+            chunk_end = position + len(chunk)
+            if chunk_end > start:
+                yield chunk[max(start - position, 0):end - position]
+            position = chunk_end
+            if position >= end:
+                break
+    finally:
+        chunks.close()
+
+
+def _entry_key(entry):
+    """Returns the key which git sorts entries of a tree by."""
+    if isinstance(entry, dict):  # resource returned by get_resources
+        name, entry_type = entry['name'], entry['type']
+    else:
+        name, entry_type = entry.name, entry.type
+    return name + '/' if entry_type == 'tree' else name
+
+
+def _decode_cursor(kind, cursor):
+    try:
+        cursor_kind, last = json.loads(urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        raise InvalidCursorError("cursor is invalid: {0}".format(cursor))
+    if cursor_kind != kind:
+        raise InvalidCursorError("cursor is not for {0}: {1}".format(kind,
+                                                                    cursor))
+    return last
+
+
+def _apply_edits(path, edits):
+    """Commits `edits` of a branch one by one without any working tree, and
+    moves the branch to the last commit by a single ref update. An edit
+    whose objectid is stale fails with CanNotUpdateError. The branch is
+    updated only if it has not been moved since it is read, otherwise all
+    the edits fail with CanNotUpdateError, and any other failure of the
+    update with UnignorableError.
+    """
+    repo = _repo_pool.get(path)
+    branch = edits[0].branch
+    heads = dict((h.name, h) for h in repo.branches)
+    parent = heads[branch].commit if branch in heads else None
+    head = parent.hexsha if parent else None
+    tree = parent.tree.hexsha if parent else None
+    blobs = {}  # path -> hexsha of the blob written by preceding edits
+    accepted = []
+    for edit in edits:
+        if edit.path in blobs:
+            current = blobs[edit.path]
+        else:
+            try:
+                current = parent.tree[edit.path].hexsha if parent else None
+            except KeyError:
+                current = None
+        if edit.objectid != current:
+            edit.finish(error=CanNotUpdateError(
+                "Resource is already updated."))
+            continue
+        head, tree, blobs[edit.path] = _write_commit(
+            repo, head, tree, edit.path, edit.data, edit.message)
+        accepted.append((edit, head))
+    if not accepted:
+        return
+
+    ref = 'refs/heads/{0}'.format(branch)
+    expected = parent.hexsha if parent else None
+    status, _, error = _run_git(repo, ['update-ref', ref, head,
+                                       expected or '0' * 40])
+    if status != 0:
+        if _read_ref(repo, ref) != expected:  # moved by someone
+            raise CanNotUpdateError("Resource is already updated.")
+        raise UnignorableError(error.decode('utf-8', 'replace').strip())
+    for edit, commit in accepted:
+        edit.finish(commit)
+
+
+def _write_commit(repo, parent, tree, path, data, message):
+    """Writes the blob of `data` at `path`, the trees along the path and a
+    commit onto `parent` (hexsha, or None for the root commit). Returns
+    hexshas of the commit, its tree and the blob.
+    """
+    names = path.split('/')
+    if set(names) & set(['', '.', '..']):
+        raise CanNotUpdateError("path is invalid: {0}".format(path))
+    blob = _write_object(repo, 'blob', data)
+    tree = hexlify(_update_tree(repo, tree, names, blob))
+
+    author = '{0} <{1}> {2} {3}'.format(Config.SYSTEM_AUTHOR,
+                                        Config.SYSTEM_MAILADDRESS,
+                                        int(time()), _get_tz_offset())
+    if isinstance(message, unicode):
+        message = message.encode('utf-8')
+    lines = ['tree {0}'.format(tree)]
+    if parent:
+        lines.append('parent {0}'.format(parent))
+    lines.extend(['author {0}'.format(author),
+                  'committer {0}'.format(author),
+                  '',
+                  message.rstrip('\n') + '\n'])
+    commit = hexlify(_write_object(repo, 'commit', '\n'.join(lines)))
+    return commit, tree, hexlify(blob)
+
+
+def _update_tree(repo, tree, names, blob):
+    """Writes the tree `tree` (hexsha, or None if it does not exist) whose
+    entry at the path `names` is replaced with `blob`, and returns its
+    binsha.
+    """
+    entries = {}  # name -> (mode, binsha)
+    if tree:
+        data = _read_object(repo, tree)
+        position = 0
+        while position < len(data):
+            separator = data.index('\0', position)
+            mode, name = data[position:separator].split(' ', 1)
+            entries[name] = (mode, data[separator + 1:separator + 21])
+            position = separator + 21
+
+    name = names[0]
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+    mode, binsha = entries.get(name, (None, None))
+    if len(names) == 1:
+        if not mode in ('100644', '100755'):
+            mode = '100644'
+        entries[name] = (mode, blob)
+    else:
+        subtree = hexlify(binsha) if mode == '40000' else None
+        entries[name] = ('40000',
+                         _update_tree(repo, subtree, names[1:], blob))
+
+    def key(entry_name):
+        if entries[entry_name][0] == '40000':
+            return entry_name + '/'
+        return entry_name
+    return _write_object(repo, 'tree', ''.join(
+        '{0} {1}\0{2}'.format(entries[name][0], name, entries[name][1])
+        for name in sorted(entries, key=key)))
+
+
+def _write_object(repo, objtype, data):
+    """Writes the object by git, which creates it with the permission of
+    core.sharedRepository, and returns its binsha.
+    """
+    status, output, error = _run_git(
+        repo, ['hash-object', '-w', '-t', objtype, '--stdin'], data)
+    if status != 0:
+        raise UnignorableError(error.decode('utf-8', 'replace').strip())
+    return unhexlify(output.strip())
+
+
+def _read_ref(repo, ref):
+    status, output, _ = _run_git(repo, ['rev-parse', '-q', '--verify', ref])
+    return output.strip() if status == 0 else None
+
+
+def _run_git(repo, args, data=None):
+    """Runs git with `args` on `repo`, passing `data` to its stdin, and
+    returns the status, stdout and stderr.
+    """
+    process = Popen(['git', '--git-dir', repo.git_dir] + args,
+                    stdin=PIPE, stdout=PIPE, stderr=PIPE)
+    output, error = process.communicate(data)
+    return process.returncode, output, error
+
+
+def _get_tz_offset():
+    if daylight and localtime().tm_isdst > 0:
+        offset = -altzone
+    else:
+        offset = -timezone
+    sign = '+' if offset >= 0 else '-'
+    return '{0}{1:02d}{2:02d}'.format(sign, abs(offset) // 3600,
+                                      abs(offset) // 60 % 60)
+
+
+def _get_content(commit, path):
+    if commit is None:
+        return None
+    try:
+        blob = commit.tree[path]
+    except KeyError:
+        return None
+    if blob.type != 'blob':
+        raise NotFoundError("path is not a file: {0}".format(path))
+    return _read_object(commit.repo, blob.hexsha).decode('utf-8', 'replace')
+
+
+def _read_object(repo, hexsha):
+    try:
+        return _catfile_pool.read(repo.git_dir, hexsha)[2]
+    except KeyError:
+        raise NotFoundError("object is not found: {0}".format(hexsha))
+
+
+def _get_blame_lines(project, repository, commit, path):
+    """Returns a list of [hexsha, content] for each line of the file.
+
+    Blames are cached by commit and path. If the file is not cached at the
+    commit but at its only parent, the lines unchanged from the parent
+    reuse the cached blame of the parent, and only the changed lines are
+    attributed to the commit.
+    """
+    key = '{0}:{1}'.format(commit.hexsha, path)
+    cached = _blame_cache.get(key)
+    if cached is not None:
+        return json.loads(cached)
+
+    lines = None
+    if len(commit.parents) == 1:
+        parent = commit.parents[0]
+        cached = _blame_cache.get('{0}:{1}'.format(parent.hexsha, path))
+        if cached is not None:
+            lines = _reuse_blame(commit, parent, path, json.loads(cached))
+    if lines is None:
+        lines = _blame(commit, path)
+    _blame_cache.set(key, json.dumps(lines))
+    return lines
+
+
+def _blame(commit, path):
+    process = commit.repo.git.blame('--porcelain', commit.hexsha, '--', path,
+                                    as_process=True)
+    lines = []
+    hexsha = None
+    for line in process.stdout:
+        if line.startswith('\t'):  # content of the line
+            lines.append([hexsha, _decode_line(line[1:])])
+        else:  # header of the line, or information of the commit
+            m = _BLAME_HEADER_REGEXP.match(line)
+            if m:
+                hexsha = m.group(1)
+    try:
+        process.wait()
+    except GitCommandError:
+        raise NotFoundError("path is invalid: {0}".format(path))
+    return lines
 
 
-def _blobdata(blob, commit, rev):
+def _reuse_blame(commit, parent, path, parent_lines):
+    """Returns the blame of the file at `commit` computed from the blame at
+    its parent, or None if the file does not exist at the parent.
+    """
+    try:
+        blob = commit.tree[path]
+        parent_blob = parent.tree[path]
+    except KeyError:
+        return None
+    if blob.type != 'blob' or parent_blob.type != 'blob':
+        return None
+    if blob.binsha == parent_blob.binsha:
+        return parent_lines
+    contents = _split_lines(_read_object(commit.repo, blob.hexsha))
+    lines = []
+    i = j = 0  # next lines of the parent and the commit
+    # the hunks are taken from git, so that the lines are aligned just as
+    # `git blame` aligns them
+    for old_start, old_count, new_start, new_count in _iter_hunks(
+            commit.repo, parent_blob.hexsha, blob.hexsha):
+        while j < new_start:
+            lines.append([parent_lines[i][0], contents[j]])
+            i += 1
+            j += 1
+        lines.extend([commit.hexsha, content]
+                     for content in contents[j:j + new_count])
+        i = old_start + old_count
+        j = new_start + new_count
+    lines.extend([hexsha, content] for (hexsha, _), content
+                 in zip(parent_lines[i:], contents[j:]))
+    return lines
+
+
+def _iter_hunks(repo, old_hexsha, new_hexsha):
+    """Yields (old_start, old_count, new_start, new_count) of each hunk of
+    the diff between the blobs. Starts are 0-based indexes of the first
+    changed lines, or of the lines after an empty range.
+    """
+    output = repo.git.diff('-U0', '--text', '--no-color', '--no-ext-diff',
+                           '--no-textconv', old_hexsha, new_hexsha)
+    for line in output.split('\n'):
+        m = _HUNK_HEADER_REGEXP.match(line)
+        if m:
+            old_start, old_count, new_start, new_count = \
+                [int(n) if n is not None else 1 for n in m.groups()]
+            # an empty range is given by the line before it
+            yield (old_start - 1 if old_count else old_start, old_count,
+                   new_start - 1 if new_count else new_start, new_count)
+
+
+def _split_lines(data):
+    lines = data.split('\n')
+    if data.endswith('\n'):
+        lines.pop()
+    return [_decode_line(line) for line in lines]
+
+
+def _decode_line(line):
+    return line.rstrip('\n').decode('utf-8', 'replace')
+
+
+def _get_commitinfo(repo, hexsha):
+    """Returns the metadata of the commit. Metadata are cached by binary
+    sha across repositories, since a commit never changes.
+    """
+    key = unhexlify(hexsha)
+    info = _commit_cache.get(key)
+    if info is None:
+        info = _read_commitinfo(repo, hexsha)
+        _commit_cache.set(key, info)
+    return info
+
+
+def _read_commitinfo(repo, hexsha):
+    """Returns the metadata of the commit parsed from its raw object."""
+    header, _, message = _read_object(repo, hexsha).partition('\n\n')
+    parents = []
+    author = committer = ''
+    encoding = 'utf-8'
+    for line in header.split('\n'):
+        key, _, value = line.partition(' ')
+        if key == 'parent':
+            parents.append(value)
+        elif key == 'author':
+            author = value
+        elif key == 'committer':
+            committer = value
+        elif key == 'encoding':
+            encoding = value
+    return _CommitInfo(hexsha=str(hexsha),
+                       parents=tuple(parents),
+                       author=author[:author.rfind('<')].strip().decode(
+                           encoding, 'replace'),
+                       committed_date=int(committer.rsplit(' ', 2)[-2]),
+                       message=message.decode(encoding, 'replace'))
+
+
+def _commitdata(repo, hexsha):
+    info = _get_commitinfo(repo, hexsha)
+    return {'commit': info.hexsha,
+            'parents': list(info.parents),
+            'timestamp': info.committed_date,
+            'author': info.author,
+            'message': info.message}
+
+
+def _blobdata(blob, info, rev):
     return {'name': blob.name,
             'path': '/'.join([rev, blob.path]),
             'type': 'blob',
-            'timestamp': commit.committed_date,
-            'author': commit.author.name,
-            'message': commit.message}
+            'timestamp': info.committed_date,
+            'author': info.author,
+            'message': info.message}
 
 
-def _set_permission(path, username):
-    uid = getpwnam(username)[2]
-    gid = getgrnam(Config.USER_GROUP)[2]
-    _set_permission_to_dir(path, uid, gid)
-    for root, dirs, files in os.walk(path):
-        for d in dirs:
-            _set_permission_to_dir(os.path.join(root, d), uid, gid)
-        for f in files:
-            _set_permission_to_file(os.path.join(root, f), uid, gid)
-
-
-def _set_permission_to_dir(path, uid, gid):
-    os.chown(path, uid, gid)
-    os.chmod(path, 0770)
+def _clone(job, uri, repo_uri, path, username):
+    """Clones `uri` to a temporary directory beside `path`, which is renamed
+    to `path` when completed, so that a partial clone is never visible.
+    `repo_uri`, the uri without credentials, is shown in error messages.
+    """
+    tmp_path = '{0}.{1}.clone'.format(path[:-4], job.id)
+    try:
+        status, message = _run_with_progress(
+            job, ['git', 'clone', '--bare', '--progress',
+                  '--config', 'core.sharedRepository={0}'.format(
+                      _SHARED_REPOSITORY),
+                  uri, tmp_path])
+        if status != 0:
+            raise UnignorableError(message.replace(uri, repo_uri))
+        job.report('Setting permission')
+        _set_permission(tmp_path, username)
+        if os.path.exists(path):
+            raise CanNotUpdateError("repository already exists: {0}".format(
+                job.target))
+        os.rename(tmp_path, path)
+        job.report('Completed', 100)
+    finally:
+        if os.path.exists(tmp_path):
+            rmtree(tmp_path)
+
+
+def _run_with_progress(job, args):
+    """Runs the git command, reporting its progress to `job`. Returns the
+    exit status and the first error message of the command, or the last
+    message if there is no error.
+    """
+    with open(os.devnull, 'w') as devnull:
+        process = Popen(args, stdout=devnull, stderr=PIPE,
+                        preexec_fn=lambda: os.umask(0007))
+    message = ''
+    rest = ''
+    while True:
+        chunk = os.read(process.stderr.fileno(), 4096)
+        lines = (rest + chunk).replace('\r', '\n').split('\n')
+        rest = lines.pop() if chunk else ''
+        for line in filter(None, (l.strip() for l in lines)):
+            if not message.startswith(('fatal:', 'error:')):
+                message = line
+            m = _PROGRESS_REGEXP.match(line)
+            if m:
+                job.report(m.group(1), int(m.group(2)))
+        if not chunk:
+            break
+    process.stderr.close()
+    return process.wait(), message
 
 
-def _set_permission_to_file(path, uid, gid):
-    os.chown(path, uid, gid)
-    os.chmod(path, 0660)
+def _set_permission(path, username):
+    """Gives the directory `path` to the user and Config.USER_GROUP as a
+    setgid directory accessible to the group. Entries under it are not
+    touched: git creates them in the group of the directory, with the
+    permission of core.sharedRepository for the objects and refs, and of
+    umask 007 for clones.
+    """
+    gid = getgrnam(Config.USER_GROUP)[2]
+    st = os.lstat(path)
+    if Config.AUTH_BACKEND == 'system':
+        uid = getpwnam(username)[2]
+    else:  # users of the database backend are not linux users
+        uid = st.st_uid
+    if (st.st_uid, st.st_gid) != (uid, gid):
+        os.chown(path, uid, gid)
+    if S_IMODE(st.st_mode) != _DIR_MODE:
+        os.chmod(path, _DIR_MODE)
+
+
+def _set_group_permission(path, gid):
+    """Lets the group access every entry under `path`, which is checked by
+    a single lstat each, so that only the entries which are actually wrong
+    are changed. Returns the number of entries changed.
+    """
+    changed = 0
+    for name in os.listdir(path):
+        entry = os.path.join(path, name)
+        st = os.lstat(entry)
+        if S_ISLNK(st.st_mode):
+            continue
+        mode = S_IMODE(st.st_mode)
+        if S_ISDIR(st.st_mode):
+            expected = _DIR_MODE
+            changed += _set_group_permission(entry, gid)
+        elif not mode & 0222:  # read-only, e.g. 0444 objects
+            # git replaces such files instead of writing them
+            expected = mode | 0440
+        else:
+            expected = (mode & 0770) | 0660
+        if st.st_gid != gid or mode != expected:
+            if st.st_gid != gid:
+                os.chown(entry, -1, gid)
+            if mode != expected:
+                os.chmod(entry, expected)
+            changed += 1
+    return changed
 
 
 class NotFoundError(Exception):
@@ -370,3 +969,7 @@ class CanNotUpdateError(Exception):
 
 class UnignorableError(Exception):
     pass
+
+
+class InvalidCursorError(Exception):
+    pass
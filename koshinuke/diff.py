@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+    koshinuke.diff
+    ~~~~~~~~~~~~~~
+
+    Implements the diff of commits with bounded patches.
+
+    :copyright: (c) 2012 lanius
+    :license: Apache License, Version 2.0, see LICENSE for more details.
+"""
+
+import os
+from subprocess import Popen, PIPE
+
+
+_OPERATIONS = {'A': 'add', 'C': 'add', 'D': 'delete', 'R': 'rename'}
+
+
+class Budget(object):
+    """Limits the size of patches, `max_patch_size` bytes per file and
+    `max_total_size` bytes in total.
+    """
+
+    def __init__(self, max_patch_size, max_total_size):
+        self.max_patch_size = max_patch_size
+        self.remaining = max_total_size
+
+
+def get_diffs(path, parent, commit, budget):
+    """Returns a list of diffs of the files changed from `parent` to `commit`
+    (hexshas, `parent` is None for the root commit) in the repository at
+    `path`.
+
+    Patches and line counts are computed together by a single
+    `git diff-tree`, whose output is read line by line. A patch is cut off
+    when it exceeds the budget, and the diff is marked as truncated, but its
+    lines are still counted.
+    """
+    args = ['git', '--git-dir', path, '-c', 'core.quotepath=false',
+            'diff-tree', '-r', '-M', '--patch-with-raw', '--full-index',
+            '--no-color', '--no-ext-diff']
+    args.extend([parent, commit] if parent else ['--root', commit])
+    with open(os.devnull, 'w') as devnull:
+        process = Popen(args, stdout=PIPE, stderr=devnull)
+    try:
+        return _parse(process.stdout, budget, bool(parent))
+    finally:
+        process.stdout.close()
+        process.wait()
+
+
+def get_stats(diffs):
+    """Returns statistics of `diffs` in the form of `Commit.stats`."""
+    files = {}
+    total = {'insertions': 0, 'deletions': 0, 'lines': 0, 'files': 0}
+    for d in diffs:
+        lines = d['insertions'] + d['deletions']
+        files[d['newpath']] = {'insertions': d['insertions'],
+                               'deletions': d['deletions'],
+                               'lines': lines}
+        total['insertions'] += d['insertions']
+        total['deletions'] += d['deletions']
+        total['lines'] += lines
+        total['files'] += 1
+    return {'files': files, 'total': total}
+
+
+def _parse(stream, budget, has_parent):
+    lines = iter(stream.readline, '')
+    if not has_parent:
+        next(lines, None)  # the root commit is printed first
+    diffs = []
+    headers = {}  # 'diff --git' line -> diff
+    for line in lines:
+        if line == '\n':  # raw output is followed by patches
+            break
+        d, header = _parse_raw(line.rstrip('\n'))
+        diffs.append(d)
+        headers[header] = d
+
+    # Patches are matched to diffs by their headers, since a change between
+    # a file and a symlink is split into two patches, a deletion and an
+    # addition of the path, which are merged into its diff.
+    d = None
+    patch = None
+    for line in lines:
+        if line.startswith('diff --git '):
+            d = headers.get(line.rstrip('\n'))
+            patch = None
+            continue
+        if d is None:
+            continue
+        if patch is None:  # extended headers
+            if line.startswith('@@'):
+                patch = []
+            elif line.startswith('Binary files '):
+                d['binary'] = True
+                continue
+            else:
+                continue
+        if line[0] == '+':
+            d['insertions'] += 1
+        elif line[0] == '-':
+            d['deletions'] += 1
+        if d['truncated']:
+            continue
+        size = len(line)
+        if d['size'] + size > budget.max_patch_size or \
+                size > budget.remaining:
+            d['truncated'] = True
+            continue
+        d['size'] += size
+        budget.remaining -= size
+        d['patch'].append(line)
+
+    for d in diffs:
+        d['patch'] = ''.join(d.pop('patch')).decode('utf-8', 'replace')
+        del d['size']
+    return diffs
+
+
+def _parse_raw(line):
+    """Parses a line of raw output, e.g.
+    ':100644 100644 <oldsha> <newsha> R087\told\tnew', and returns the diff
+    and the 'diff --git' line of its patch.
+    """
+    meta, quoted = line[1:].split('\t', 1)
+    oldmode, newmode, oldsha, newsha, status = meta.split(' ')
+    quoted = quoted.split('\t')
+    header = 'diff --git {0} {1}'.format(_prefix('a/', quoted[0]),
+                                         _prefix('b/', quoted[-1]))
+    paths = [_unquote(p) for p in quoted]
+    return {'newpath': paths[-1],
+            'oldpath': paths[0],
+            'operation': _OPERATIONS.get(status[0], 'modify'),
+            'newobjectid': None if set(newsha) == set('0') else newsha,
+            'oldobjectid': None if set(oldsha) == set('0') else oldsha,
+            'insertions': 0,
+            'deletions': 0,
+            'binary': False,
+            'truncated': False,
+            'size': 0,
+            'patch': []}, header
+
+
+def _prefix(prefix, path):
+    """Prefixes a path which may be quoted by git."""
+    if path.startswith('"'):
+        return '"' + prefix + path[1:]
+    return prefix + path
+
+
+def _unquote(path):
+    """Unquotes a path quoted by git in the manner of C string literals."""
+    if path.startswith('"') and path.endswith('"'):
+        path = path[1:-1].decode('string_escape')
+    return path.decode('utf-8', 'replace')
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+    koshinuke.history
+    ~~~~~~~~~~~~~~~~~
+
+    Implements the activity histogram of branches.
+
+    :copyright: (c) 2012 lanius
+    :license: Apache License, Version 2.0, see LICENSE for more details.
+"""
+
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+import json
+from time import mktime
+
+from git.exc import GitCommandError
+
+
+def get_activities(repo, branches, days=30, now=None, counts_cache=None):
+    """Returns a list of activities for each branch, in the same order as
+    `branches`. An activity is a list of [timestamp, count] for each day,
+    counted back from the day of `now`.
+
+    Daily commit counts of each branch are cached in the DiskCache
+    `counts_cache` by the repository, together with the tip of the branch.
+    When the tip moves, only the commits between the old and the new tip
+    are walked and merged into the cache.
+    """
+    if now is None:
+        now = datetime.today()
+    today = now.date().toordinal()
+    buckets = _get_buckets(repo, branches, counts_cache)
+    return [[[int(mktime((now - timedelta(days=i)).timetuple())),
+              b.get(today - i, 0)]
+             for i in xrange(days)]
+            for b in buckets]
+
+
+def _get_buckets(repo, branches, counts_cache):
+    """Returns a list of dictionaries, day ordinal -> number of commits,
+    for each branch.
+    """
+    cached = counts_cache.get(repo.git_dir) if counts_cache else None
+    cached = json.loads(cached) if cached else {}
+    entries = {}
+    updated = set(cached.keys()) != set(h.name for h in branches)
+    uncached = []
+    for h in branches:
+        tip = h.commit.hexsha
+        entry = cached.get(h.name)
+        if entry and entry['tip'] == tip:
+            buckets = dict((int(k), v) for k, v in entry['days'].iteritems())
+        elif entry:
+            buckets = _update(repo, entry, tip)
+            updated = True
+        else:
+            buckets = None
+            updated = True
+        if buckets is None:
+            uncached.append(h)
+        else:
+            entries[h.name] = {'tip': tip, 'days': buckets}
+
+    for h, buckets in zip(uncached, _count(repo, uncached)):
+        entries[h.name] = {'tip': h.commit.hexsha, 'days': buckets}
+
+    if counts_cache and updated:
+        counts_cache.set(repo.git_dir, json.dumps(entries))
+    return [entries[h.name]['days'] for h in branches]
+
+
+def _update(repo, entry, tip):
+    """Merges the commits between the cached tip and the new `tip` into the
+    cached buckets. Returns None if the cached tip is not an ancestor of the
+    new one, e.g. the branch was rewritten by force push, or if it no longer
+    exists, e.g. it was pruned after that.
+    """
+    old = entry['tip']
+    buckets = defaultdict(int)
+    for k, v in entry['days'].iteritems():
+        buckets[int(k)] = v
+    try:
+        lines = repo.git.rev_list('--parents', '--timestamp', tip,
+                                  '^{0}'.format(old)).splitlines()
+    except GitCommandError:  # bad object
+        return None
+    is_ancestor = False
+    for line in lines:
+        fields = line.split()
+        if old in fields[2:]:
+            is_ancestor = True
+        buckets[_day(int(fields[0]))] += 1
+    if not is_ancestor:
+        return None
+    return dict(buckets)
+
+
+def _count(repo, branches):
+    """Returns a list of dictionaries, day ordinal -> number of commits,
+    for each branch.
+
+    The union of all branches is walked once by a single `git rev-list`,
+    and each commit is marked with a bit for every branch reaching it.
+    """
+    counts = [defaultdict(int) for _ in branches]
+    if not branches:
+        return counts
+
+    marks = defaultdict(int)  # hexsha -> bits of branches reaching it
+    for n, h in enumerate(branches):
+        marks[h.commit.hexsha] |= 1 << n
+
+    # --topo-order guarantees that children come before their parents,
+    # so marks are completed before a commit is visited.
+    grouped = defaultdict(int)  # (bits, day ordinal) -> number of commits
+    for line in repo.git.rev_list('--topo-order', '--parents', '--timestamp',
+                                  *set(h.commit.hexsha for h in branches)
+                                  ).splitlines():
+        fields = line.split()
+        timestamp, hexsha, parents = int(fields[0]), fields[1], fields[2:]
+        bits = marks.pop(hexsha, 0)
+        for parent in parents:
+            marks[parent] |= bits
+        grouped[(bits, _day(timestamp))] += 1
+
+    for (bits, day), count in grouped.iteritems():
+        while bits:
+            lowest = bits & -bits
+            counts[lowest.bit_length() - 1][day] += count
+            bits ^= lowest
+    return [dict(c) for c in counts]
+
+
+def _day(timestamp):
+    return date.fromtimestamp(timestamp).toordinal()
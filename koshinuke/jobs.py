@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+    koshinuke.jobs
+    ~~~~~~~~~~~~~~
+
+    Implements the queue of background jobs.
+
+    :copyright: (c) 2012 lanius
+    :license: Apache License, Version 2.0, see LICENSE for more details.
+"""
+
+from collections import OrderedDict
+from Queue import Queue
+from threading import Lock, Thread
+from time import time
+from uuid import uuid4
+
+
+class Job(object):
+    """A background job. Its state goes 'queued', 'running', and then
+    'done' or 'failed'. The task reports its progress by `report`.
+    """
+
+    def __init__(self, kind, target):
+        self.id = uuid4().hex
+        self.kind = kind
+        self.target = target
+        self.state = 'queued'
+        self.phase = None
+        self.percent = None
+        self.error = None
+        self.created = time()
+        self.started = None
+        self.finished = None
+
+    def report(self, phase, percent=None):
+        self.phase = phase
+        self.percent = percent
+
+    def to_dict(self):
+        return {'id': self.id,
+                'kind': self.kind,
+                'target': self.target,
+                'state': self.state,
+                'phase': self.phase,
+                'percent': self.percent,
+                'error': self.error,
+                'created': self.created,
+                'started': self.started,
+                'finished': self.finished}
+
+
+class JobQueue(object):
+    """Queue of jobs run by at most `workers` threads. Finished jobs are
+    kept for status queries, at most `history` of them.
+    """
+
+    def __init__(self, workers, history=100):
+        self.workers = workers
+        self.history = history
+        self._jobs = OrderedDict()  # id -> Job, in order of submission
+        self._queue = Queue()
+        self._threads = []
+        self._lock = Lock()
+
+    def submit(self, kind, target, task, *args):
+        """Queues `task(job, *args)`, and returns the job. The job fails
+        with the message of the exception if the task raises one.
+        """
+        job = Job(kind, target)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._forget()
+            if len(self._threads) < self.workers:
+                thread = Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        self._queue.put((job, task, args))
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            states = [job.state for job in self._jobs.itervalues()]
+        return dict((state, states.count(state))
+                    for state in ['queued', 'running', 'done', 'failed'])
+
+    def _forget(self):
+        finished = [job_id for job_id, job in self._jobs.iteritems()
+                    if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    def _work(self):
+        while True:
+            job, task, args = self._queue.get()
+            try:
+                self._run(job, task, args)
+            except Exception:  # the worker must keep serving the queue
+                job.state = 'failed'
+                job.finished = time()
+
+    def _run(self, job, task, args):
+        job.state = 'running'
+        job.started = time()
+        try:
+            task(job, *args)
+        except Exception as e:
+            job.error = _get_message(e)
+            job.state = 'failed'
+        else:
+            job.state = 'done'
+        job.finished = time()
+
+
+def _get_message(e):
+    try:
+        return unicode(e)
+    except UnicodeError:  # a message of bytes which are not ascii
+        return str(e).decode('utf-8', 'replace')
@@ -19,24 +19,31 @@ import random
 import re
 
 from flask import (Flask, request, render_template, abort, redirect, url_for,
-                   session)
+                   session, make_response)
 from flaskext.kvsession import KVSessionExtension
-from simplekv.memory import DictStore
 from werkzeug import SharedDataMiddleware
 
+from cache import DiskCache, MemoryCache
 from config import Config
 import core
-from core import NotFoundError, CanNotUpdateError
+from core import NotFoundError, CanNotUpdateError, InvalidCursorError
+import auth
 from auth import authenticate
+from sessions import create_store, start_sweeper
 
 app = Flask(__name__)
 
-store = DictStore()
-KVSessionExtension(store, app)
+
+# configuration, except HOST which is found lazily by app.run
+app.config.update((key, getattr(Config, key)) for key in dir(Config)
+                  if key.isupper() and key != 'HOST')
 
 
-# configuration
-app.config.from_object(Config)
+# session setting
+store = create_store(Config.SESSION_STORE, Config.SESSION_PATH)
+KVSessionExtension(store, app)
+start_sweeper(store, app.permanent_session_lifetime.total_seconds(),
+              Config.SESSION_SWEEP_INTERVAL)
 
 
 # logger setting
@@ -55,11 +62,75 @@ else:
 
 API_VERSION = '1.0'
 
+_HEXSHA_REGEXP = re.compile(r'[0-9a-f]{40}$')
+_STREAM_BUFFER_SIZE = 16 * 1024
+
+if Config.RESPONSE_CACHE_DISK_SIZE:
+    response_cache = MemoryCache(Config.RESPONSE_CACHE_SIZE, DiskCache(
+        os.path.join(Config.CACHE_ROOT, 'responses'),
+        Config.RESPONSE_CACHE_DISK_SIZE))
+else:
+    response_cache = MemoryCache(Config.RESPONSE_CACHE_SIZE)
+
 
 def jsonify(data):
     return json.dumps(data, ensure_ascii=False)
 
 
+def jsonify_stream(data):
+    """Returns a streamed response of `data`, in which iterators such as
+    generators are serialized as arrays element by element, so that the
+    whole data is never built in memory.
+    """
+    def generate():
+        buf = []
+        size = 0
+        for chunk in _iterencode(data):
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode('utf-8')
+            buf.append(chunk)
+            size += len(chunk)
+            if size >= _STREAM_BUFFER_SIZE:
+                yield ''.join(buf)
+                buf = []
+                size = 0
+        if buf:
+            yield ''.join(buf)
+    return app.response_class(generate())
+
+
+def _iterencode(data):
+    if isinstance(data, dict):
+        yield '{'
+        for n, (key, value) in enumerate(data.iteritems()):
+            yield (', ' if n else '') + jsonify(key) + ': '
+            for chunk in _iterencode(value):
+                yield chunk
+        yield '}'
+    elif isinstance(data, (list, tuple)) or hasattr(data, 'next'):
+        yield '['
+        for n, value in enumerate(data):
+            if n:
+                yield ', '
+            for chunk in _iterencode(value):
+                yield chunk
+        yield ']'
+    else:
+        yield jsonify(data)
+
+
+def paginate(kind, resources, limit):
+    """Returns a response of `resources`, with the cursor of the next page
+    in the X-KoshiNuke-Cursor header if there can be more resources.
+    """
+    response = make_response(jsonify(resources))
+    items = resources[kind] if isinstance(resources, dict) else resources
+    if items and len(items) >= limit:
+        response.headers['X-KoshiNuke-Cursor'] = core.get_next_cursor(
+            kind, resources)
+    return response
+
+
 def login_required(f):
     @wraps(f)
     def inner(*args, **kwargs):
@@ -69,6 +140,39 @@ def login_required(f):
     return inner
 
 
+def immutable(f):
+    """Caches responses of the view if `rev` is a full hexsha, since they
+    never change. Responses are served with an ETag and Cache-Control
+    telling clients that they need not be requested again.
+    """
+    @wraps(f)
+    def inner(*args, **kwargs):
+        if request.method != 'GET' or request.args.get('raw') or \
+                not _HEXSHA_REGEXP.match(kwargs.get('rev', '')):
+            return f(*args, **kwargs)
+        key = request.full_path
+        data = response_cache.get(key)
+        if data is None:
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200 or response.direct_passthrough:
+                return response
+            headers = [(k, v) for k, v in response.headers
+                       if k not in ('Content-Length', 'Content-Type')]
+            data = json.dumps(headers) + '\n' + response.get_data()
+            response_cache.set(key, data)
+        headers, body = data.split('\n', 1)
+        etag = hashlib.sha1(body).hexdigest()
+        if etag in request.if_none_match:
+            response = app.response_class(status=304)
+        else:
+            response = make_response(body)
+            response.headers.extend(json.loads(headers))
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = Config.IMMUTABLE_CACHE_CONTROL
+        return response
+    return inner
+
+
 def generate_csrf_token():
     # see Flask-SeaSurf http://packages.python.org/Flask-SeaSurf/
     salt = (randrange(0, _MAX_CSRF_KEY), Config.SECRET_KEY)
@@ -76,14 +180,7 @@ def generate_csrf_token():
 
 
 def get_initial_resources():
-    resources = []
-    for project in core.get_projects():
-        for repository in core.get_repositories(project):
-            resource = {}
-            resource.update(core.get_branches(project, repository))
-            resource.update(core.get_tags(project, repository))
-            resources.append(resource)
-    return resources
+    return core.iter_all_refs()
 
 
 @app.before_request
@@ -139,7 +236,7 @@ def logout():
 def dynamic():
     if request.method == 'GET':
         if request.headers['Accept'] == 'application/json':
-            return jsonify(get_initial_resources())
+            return jsonify_stream(get_initial_resources())
         else:
             return redirect(url_for('index'))
     else:  # create initial repository.
@@ -164,11 +261,29 @@ def dynamic():
             repo_password = request.form.get('up')
 
             username = session['username']
-            
-            core.clone_remote_repository(repo_uri,
-                                         repo_username, repo_password,
-                                         username)
-        return jsonify(get_initial_resources())
+
+            job = core.clone_remote_repository(repo_uri,
+                                               repo_username, repo_password,
+                                               username)
+            response = make_response(jsonify(job), 202)
+            response.headers['Location'] = url_for('job', job_id=job['id'])
+            return response
+        return jsonify_stream(get_initial_resources())
+
+
+@app.route('/api/{0}/jobs/<job_id>'.format(API_VERSION))
+@login_required
+def job(job_id):
+    return jsonify(core.get_job(job_id))
+
+
+@app.route('/api/{0}/stats'.format(API_VERSION))
+@login_required
+def stats():
+    stats = core.get_stats()
+    stats['responses'] = response_cache.stats()
+    stats['shadow'] = auth.get_stats()
+    return jsonify(stats)
 
 
 @app.route('/api/{0}/<project>/<repository>/branches'.format(API_VERSION))
@@ -176,7 +291,9 @@ def dynamic():
 def branches(project, repository):
     offset = request.args.get('offset', 0, type=int)
     limit = request.args.get('limit', 100, type=int)
-    return jsonify(core.get_branches(project, repository, offset, limit))
+    cursor = request.args.get('cursor')
+    return paginate('branches', core.get_branches(project, repository, offset,
+                                                    limit, cursor), limit)
 
 
 @app.route('/api/{0}/<project>/<repository>/tags'.format(API_VERSION))
@@ -184,47 +301,99 @@ def branches(project, repository):
 def tags(project, repository):
     offset = request.args.get('offset', 0, type=int)
     limit = request.args.get('limit', 100, type=int)
-    return jsonify(core.get_tags(project, repository, offset, limit))
+    cursor = request.args.get('cursor')
+    return paginate('tags', core.get_tags(project, repository, offset, limit,
+                                          cursor), limit)
 
 
 @app.route('/api/{0}/<project>/<repository>/tree/<rev>'.format(API_VERSION))
 @login_required
+@immutable
 def tree_root(project, repository, rev):
     offset = request.args.get('offset', 0, type=int)
     limit = request.args.get('limit', 100, type=int)
-    return jsonify(core.get_resources(project, repository, rev, '',
-                                      offset, limit))
+    cursor = request.args.get('cursor')
+    return paginate('tree', core.get_resources(project, repository, rev, '',
+                                               offset, limit, cursor), limit)
 
 
 @app.route('/api/{0}/<project>/<repository>/tree/<rev>/<path:path>'\
            .format(API_VERSION))
 @login_required
+@immutable
 def tree(project, repository, rev, path):
     offset = request.args.get('offset', 0, type=int)
     limit = request.args.get('limit', 100, type=int)
-    return jsonify(core.get_resources(project, repository, rev, path,
-                                      offset, limit))
+    cursor = request.args.get('cursor')
+    return paginate('tree', core.get_resources(project, repository, rev, path,
+                                               offset, limit, cursor), limit)
 
 
 @app.route('/api/{0}/<project>/<repository>/blob/<rev>/<path:path>'\
            .format(API_VERSION),
            methods=['GET', 'POST'])
 @login_required
+@immutable
 def blob(project, repository, rev, path):
     if request.method == 'POST':
         data = json.loads(request.data)
         objectid = data.get('objectid')
         content = data.get('content')
         message = data.get('message')
+        coalesce = data.get('coalesce', False)
         core.update_resource(project, repository, rev, path,
-                             content, message, objectid)
+                             content, message, objectid, coalesce)
+    elif request.args.get('raw'):
+        return raw_blob(project, repository, rev, path)
     return jsonify(core.get_resource(project, repository, rev, path))
 
 
+def raw_blob(project, repository, rev, path):
+    """Streams the content of the blob. The objectid of the blob is used as
+    the ETag, and a single byte range is supported. Other ranges, e.g.
+    multiple ones, are ignored and the whole content is sent.
+    """
+    blob = core.get_blob(project, repository, rev, path)
+    objectid, size = blob['objectid'], blob['size']
+    if objectid in request.if_none_match:
+        response = app.response_class(status=304)
+        response.set_etag(objectid)
+        return response
+
+    start, end = 0, size
+    status = 200
+    if_range = request.headers.get('If-Range')
+    byte_range = request.range
+    if byte_range and byte_range.units == 'bytes' and \
+            len(byte_range.ranges) == 1 and \
+            (not if_range or if_range.strip('"') == objectid):
+        byte_range = byte_range.range_for_length(size)
+        if byte_range is None:  # unsatisfiable
+            response = app.response_class(status=416)
+            response.headers['Content-Range'] = 'bytes */{0}'.format(size)
+            return response
+        start, end = byte_range
+        status = 206
+
+    response = app.response_class(
+        core.iter_blob(project, repository, objectid, start, end),
+        status=status, mimetype='application/octet-stream',
+        direct_passthrough=True)
+    response.set_etag(objectid)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Content-Length'] = str(end - start)
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    if status == 206:
+        response.headers['Content-Range'] = 'bytes {0}-{1}/{2}'.format(
+            start, end - 1, size)
+    return response
+
+
 @app.route('/api/{0}/<project>/<repository>/history'.format(API_VERSION))
 @login_required
 def history(project, repository):
-    return jsonify(core.get_history(project, repository))
+    days = request.args.get('days', 30, type=int)
+    return jsonify(core.get_history(project, repository, days))
 
 
 @app.route('/api/{0}/<project>/<repository>/commits/<ref>'.format(API_VERSION))
@@ -233,8 +402,10 @@ def commits_root(project, repository, ref):
     rev = request.args.get('commit', None)
     offset = request.args.get('offset', 0, type=int)
     limit = request.args.get('limit', 30, type=int)
-    return jsonify(core.get_commits(project, repository, ref, rev,
-                                    offset=offset, limit=limit))
+    cursor = request.args.get('cursor')
+    return paginate('commits', core.get_commits(project, repository, ref, rev,
+                                                offset=offset, limit=limit,
+                                                cursor=cursor), limit)
 
 
 @app.route('/api/{0}/<project>/<repository>/commits/<ref>/<path:path>'\
@@ -244,21 +415,36 @@ def commits(project, repository, ref, path):
     rev = request.args.get('commit', None)
     offset = request.args.get('offset', 0, type=int)
     limit = request.args.get('limit', 30, type=int)
-    return jsonify(core.get_commits(project, repository, ref, rev, path,
-                                    offset=offset, limit=limit))
+    cursor = request.args.get('cursor')
+    return paginate('commits', core.get_commits(project, repository, ref, rev,
+                                                path, offset=offset,
+                                                limit=limit, cursor=cursor),
+                    limit)
 
 
 @app.route('/api/{0}/<project>/<repository>/commit/<rev>'.format(API_VERSION))
 @login_required
+@immutable
 def commit(project, repository, rev):
     return jsonify(core.get_commit(project, repository, rev))
 
 
+@app.route('/api/{0}/<project>/<repository>/commit/<rev>/contents/'
+           '<path:path>'.format(API_VERSION))
+@login_required
+@immutable
+def commit_contents(project, repository, rev, path):
+    oldpath = request.args.get('oldpath')
+    parent = request.args.get('parent', 0, type=int)
+    return jsonify(core.get_commit_contents(project, repository, rev, path,
+                                            oldpath, parent))
+
+
 @app.route('/api/{0}/<project>/<repository>/blame/<rev>/<path:path>'\
            .format(API_VERSION))
 @login_required
 def blame(project, repository, rev, path):
-    return jsonify(core.get_blame(project, repository, rev, path))
+    return jsonify_stream(core.iter_blame(project, repository, rev, path))
 
 
 @app.errorhandler(500)
@@ -268,6 +454,8 @@ def exception_handler(error):
         return "Not found.", 404
     elif isinstance(error, CanNotUpdateError):
         return "Resource is already updated.", 409
+    elif isinstance(error, InvalidCursorError):
+        return "Invalid cursor.", 400
     app.logger.exception("An internal server error occurred.")
     return "Server error occurred.", 500
 
@@ -279,6 +467,12 @@ def exception_handler(error):
 
 
 if __name__ == '__main__':
+    # build the index of refs before serving
+    core.get_all_refs(progress=lambda done, total, path, seconds:
+                      app.logger.info("scanned {0} in {1:.3f}s ({2}/{3})"
+                                      .format(path, seconds, done, total)))
+    app.logger.info("scan finished: {0}".format(
+        core.get_stats()['refs']['last_scan']))
     app.wsgi_app = SharedDataMiddleware(
         app.wsgi_app, {'/': os.path.join(os.path.dirname(__file__), 'static')})
-    app.run(app.config['HOST'], app.config['PORT'])
+    app.run(Config.HOST, app.config['PORT'])
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+    koshinuke.lastcommit
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Implements the index of the last commit that modified each entry of
+    a directory.
+
+    :copyright: (c) 2012 lanius
+    :license: Apache License, Version 2.0, see LICENSE for more details.
+"""
+
+import json
+
+
+def get_last_commits(commit, path='', index_cache=None):
+    """Returns a dictionary, entry name -> hexsha of the commit which last
+    modified the entry, for every entry of the directory `path` at `commit`.
+
+    The first parent history is walked back comparing object ids of the
+    entries, instead of computing diffs. Indexes are stored per commit in
+    the DiskCache `index_cache`, and the walk stops at the first commit
+    already indexed, so a new commit costs only the commits made after the
+    last indexed one.
+    """
+    path = path.strip('/')
+    index = _load(index_cache, commit.hexsha)
+    if path in index:
+        return index[path]
+
+    treesha, pending = _get_entries(commit, path)
+    result = {}
+    child = commit
+    while pending:
+        if not child.parents:
+            result.update(dict.fromkeys(pending, child.hexsha))
+            break
+        parent = child.parents[0]
+        parent_treesha, entries = _get_entries(parent, path)
+        if parent_treesha != treesha:
+            for name, binsha in pending.items():
+                if entries.get(name) != binsha:
+                    result[name] = child.hexsha
+                    del pending[name]
+            treesha = parent_treesha
+        known = _load(index_cache, parent.hexsha).get(path)
+        if known is not None:
+            result.update((name, known[name]) for name in pending)
+            break
+        child = parent
+
+    if index_cache:
+        index[path] = result
+        index_cache.set(commit.hexsha, json.dumps(index))
+    return result
+
+
+def _get_entries(commit, path):
+    """Returns the object id of the directory `path` at `commit`, and a
+    dictionary of its entries, name -> object id.
+    """
+    try:
+        tree = commit.tree[path] if path else commit.tree
+    except KeyError:  # the directory does not exist at the commit
+        return None, {}
+    if tree.type != 'tree':
+        return None, {}
+    return tree.binsha, dict((e.name, e.binsha) for e in tree)
+
+
+def _load(index_cache, hexsha):
+    cached = index_cache.get(hexsha) if index_cache else None
+    return json.loads(cached) if cached else {}
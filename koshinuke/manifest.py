@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+    koshinuke.manifest
+    ~~~~~~~~~~~~~~~~~~
+
+    Implements the bulk provisioning of users, projects and repositories
+    listed in a manifest.
+
+    :copyright: (c) 2012 lanius
+    :license: Apache License, Version 2.0, see LICENSE for more details.
+"""
+
+from collections import OrderedDict
+import csv
+import json
+from multiprocessing.pool import ThreadPool
+from time import time
+
+import auth
+import core
+
+
+def read(f, format='jsonl'):
+    """Returns the items of the manifest `f`, which is 'jsonl' (a JSON
+    object per line) or 'csv' (with a header row of the keys). An item is
+    a user ('user', 'password' and 'auth_key'), a project ('project' and
+    'owner') or a repository ('project', 'repository', 'owner' and
+    optionally 'readme').
+    """
+    if format == 'jsonl':
+        items = [json.loads(line) for line in f if line.strip()]
+    elif format == 'csv':
+        items = [dict((key.strip(), value.decode('utf-8'))
+                      for key, value in row.iteritems() if key and value)
+                 for row in csv.DictReader(f)]
+    else:
+        raise ValueError("unknown manifest format: {0}".format(format))
+    for number, item in enumerate(items, 1):
+        if not item.get('user') and not (item.get('project') and
+                                         item.get('owner')):
+            raise ValueError("item {0} has neither user nor project and "
+                             "owner".format(number))
+    return items
+
+
+def apply(items, workers=1, progress=None):
+    """Creates the users, then the projects and then the repositories of
+    `items`, and returns a list of results (kind, name, seconds, error),
+    where error is None if it succeeded. Users are added at once, and
+    projects and repositories are created by at most `workers` threads.
+    `progress(result)` is called whenever an item is done.
+    """
+    users = []
+    projects = OrderedDict()  # project -> owner
+    repositories = []
+    for item in items:
+        if item.get('user'):
+            users.append((item['user'], item.get('password', ''),
+                          item.get('auth_key', '')))
+            continue
+        projects.setdefault(item['project'], item['owner'])
+        if item.get('repository'):
+            repositories.append((item['project'], item['repository'],
+                                 item['owner'], item.get('readme')))
+
+    results = []
+
+    def report(result):
+        results.append(result)
+        if progress:
+            progress(result)
+
+    if users:
+        report(_timed('users', '{0} users'.format(len(users)),
+                      auth.add_users, users))
+    pool = ThreadPool(max(1, workers))
+    try:
+        failed = set()  # projects
+        for result in pool.imap_unordered(_create_project, projects.items()):
+            if result[3]:
+                failed.add(result[1])
+            report(result)
+        seen = set()  # repositories
+        created = []
+        for project, repository, owner, readme in repositories:
+            name = '{0}/{1}'.format(project, repository)
+            if project in failed:
+                report(('repository', name, 0.0, u"project is not created"))
+            elif name in seen:
+                report(('repository', name, 0.0, u"repository is duplicated"))
+            else:
+                seen.add(name)
+                created.append((project, repository, owner, readme))
+        for result in pool.imap_unordered(_create_repository, created):
+            report(result)
+    finally:
+        pool.terminate()
+    return results
+
+
+def _create_project(args):
+    project, owner = args
+    return _timed('project', project, core.create_project, project, owner)
+
+
+def _create_repository(args):
+    project, repository, owner, readme = args
+    return _timed('repository', '{0}/{1}'.format(project, repository),
+                  core.create_repository, project, repository, owner, readme)
+
+
+def _timed(kind, name, f, *args):
+    started = time()
+    try:
+        f(*args)
+    except Exception as e:
+        error = unicode(str(e), 'utf-8', 'replace')
+    else:
+        error = None
+    return kind, name, time() - started, error
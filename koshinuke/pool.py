@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+    koshinuke.pool
+    ~~~~~~~~~~~~~~
+
+    Implements the pool of opened repositories.
+
+    :copyright: (c) 2012 lanius
+    :license: Apache License, Version 2.0, see LICENSE for more details.
+"""
+
+from collections import OrderedDict
+import os
+from threading import Lock
+
+from git import Repo
+from git.db import GitDB
+
+
+_STAMPED_FILES = ['HEAD', 'packed-refs', 'objects/pack']
+
+
+class RepoPool(object):
+    """Bounded pool of opened repositories keyed by path. The least
+    recently used repository is evicted when the pool is full, and a
+    repository is reopened when its refs have changed.
+
+    Repositories use the pure python object database, which does not hold
+    a git process, so that a pooled repository can be shared by threads.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._repos = OrderedDict()  # path -> (stamp, repo)
+        self._lock = Lock()
+
+    def get(self, path):
+        stamp = get_stamp(path)
+        with self._lock:
+            entry = self._repos.pop(path, None)
+            if entry and entry[0] == stamp:
+                self.hits += 1
+                self._repos[path] = entry
+                return entry[1]
+            self.misses += 1
+        repo = Repo(path, odbt=GitDB)
+        with self._lock:
+            self._repos[path] = (stamp, repo)
+            while len(self._repos) > self.size:
+                self._repos.popitem(last=False)
+        return repo
+
+    def discard(self, path):
+        with self._lock:
+            self._repos.pop(path, None)
+
+    def clear(self):
+        with self._lock:
+            self._repos.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._repos),
+                    'capacity': self.size,
+                    'hits': self.hits,
+                    'misses': self.misses}
+
+
+def get_stamp(path):
+    """Returns modification times of the files and directories holding refs
+    of the repository, and of the directory of packs. A loose ref is
+    replaced by renaming a lock file, so the mtime of its directory changes
+    whenever it is updated. Every directory under refs is stamped, since
+    a ref like 'feature/x' lives in a directory of its own, and so is
+    objects/pack, since the object database must be reopened to find a new
+    pack.
+    """
+    stamp = []
+    for name in _STAMPED_FILES:
+        try:
+            stamp.append(os.stat(os.path.join(path, name)).st_mtime)
+        except OSError:  # e.g. packed-refs does not exist
+            stamp.append(None)
+    for root, dirs, _ in os.walk(os.path.join(path, 'refs')):
+        dirs.sort()
+        try:
+            stamp.append((root, os.stat(root).st_mtime))
+        except OSError:  # removed while walking
+            pass
+    return tuple(stamp)
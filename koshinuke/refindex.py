@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+    koshinuke.refindex
+    ~~~~~~~~~~~~~~~~~~
+
+    Implements the index of refs of all repositories.
+
+    :copyright: (c) 2012 lanius
+    :license: Apache License, Version 2.0, see LICENSE for more details.
+"""
+
+from multiprocessing.pool import ThreadPool
+import os
+from threading import Lock
+from time import time
+
+from pool import get_stamp
+
+
+_SLOWEST = 10  # number of the slowest repositories reported
+
+
+class RefIndex(object):
+    """In-process index of refs of the repositories under a root directory,
+    project -> repository -> refs. Refs of a repository are loaded by
+    `load(path)`, which returns None if the path is not a repository.
+
+    Directory listings and refs are kept with modification times of the
+    directories and the ref files, so a snapshot only stats the file system
+    and reloads the repositories which have changed since the last one.
+    Repositories are reloaded by at most `workers` threads at once.
+    """
+
+    def __init__(self, load, workers=1):
+        self.load = load
+        self.workers = workers
+        self.loads = 0
+        self.last_scan = None
+        self._listings = {}  # path -> (mtime, names)
+        self._refs = {}  # path -> (stamp, refs)
+        self._lock = Lock()
+
+    def snapshot(self, root, excluded=(), progress=None):
+        """Returns a list of (project, repository, refs) sorted by project
+        and repository. `progress(done, total, path, seconds)` is called
+        whenever a repository is reloaded.
+        """
+        repositories = []  # (project, repository, path)
+        listed = set([root])
+        for project in self._list(root):
+            project_path = os.path.join(root, project)
+            if project in excluded or not os.path.isdir(project_path):
+                continue
+            listed.add(project_path)
+            repositories.extend((project, name[:-4],
+                                 os.path.join(project_path, name))
+                                for name in self._list(project_path)
+                                if name.endswith('.git'))
+
+        stale = []
+        with self._lock:
+            for _, _, path in repositories:
+                stamp = get_stamp(path)
+                entry = self._refs.get(path)
+                if not entry or entry[0] != stamp:
+                    stale.append((path, stamp))
+        self._scan(stale, progress)
+
+        snapshot = []
+        with self._lock:
+            for project, repository, path in repositories:
+                if path in self._refs:
+                    snapshot.append((project, repository,
+                                     self._refs[path][1]))
+            # forget removed projects and repositories
+            for path in set(self._listings) - listed:
+                del self._listings[path]
+            for path in set(self._refs) - set(r[2] for r in repositories):
+                del self._refs[path]
+        return snapshot
+
+    def stats(self):
+        with self._lock:
+            return {'repositories': len(self._refs),
+                    'loads': self.loads,
+                    'last_scan': self.last_scan}
+
+    def _list(self, path):
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return []
+        with self._lock:
+            entry = self._listings.get(path)
+        if entry and entry[0] == mtime:
+            return entry[1]
+        names = sorted(os.listdir(path))
+        with self._lock:
+            self._listings[path] = (mtime, names)
+        return names
+
+    def _scan(self, stale, progress):
+        """Reloads the `stale` repositories, and records the time taken."""
+        if not stale:
+            return
+        started = time()
+        workers = min(self.workers, len(stale))
+        if workers > 1:
+            pool = ThreadPool(workers)
+            results = pool.imap_unordered(self._load, stale)
+        else:
+            pool = None
+            results = (self._load(s) for s in stale)
+        timings = []
+        try:
+            for path, stamp, refs, seconds in results:
+                with self._lock:
+                    self.loads += 1
+                    self._refs.pop(path, None)
+                    if refs is not None:
+                        self._refs[path] = (stamp, refs)
+                timings.append((seconds, path))
+                if progress:
+                    progress(len(timings), len(stale), path, seconds)
+        finally:
+            if pool:
+                pool.terminate()
+        timings.sort(reverse=True)
+        with self._lock:
+            self.last_scan = {'repositories': len(stale),
+                              'workers': workers,
+                              'seconds': time() - started,
+                              'slowest': [[p, s] for s, p in
+                                          timings[:_SLOWEST]]}
+
+    def _load(self, item):
+        path, stamp = item
+        started = time()
+        refs = self.load(path)
+        return path, stamp, refs, time() - started
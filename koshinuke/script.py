@@ -9,11 +9,15 @@
     :license: Apache License, Version 2.0, see LICENSE for more details.
 """
 
+import argparse
 import sys
 import getpass
+from time import time
 
 import auth
+from config import Config
 import core
+import manifest
 
 
 def add_user():
@@ -37,3 +41,44 @@ def add_repository():
     username = raw_input('User Name:')
     core.create_repository(project, repository, username)
     print("A repository is added: {0}/{1}".format(project, repository))
+
+
+def fix_permission():
+    project = raw_input('Project:')
+    repository = raw_input('Repository:')
+    username = raw_input('User Name:')
+    changed = core.fix_permission(project, repository, username)
+    print("Permissions are fixed: {0}/{1}, {2} entries changed".format(
+        project, repository, changed))
+
+
+def provision():
+    parser = argparse.ArgumentParser(
+        description="Adds users, projects and repositories in a manifest.")
+    parser.add_argument('manifest', help="CSV or JSON lines file")
+    parser.add_argument('--format', choices=['csv', 'jsonl'],
+                        help="format of the manifest, by the extension "
+                             "if omitted")
+    parser.add_argument('--workers', type=int,
+                        default=Config.PROVISION_WORKERS,
+                        help="number of projects and repositories created "
+                             "at once")
+    args = parser.parse_args()
+    format = args.format or ('csv' if args.manifest.endswith('.csv')
+                             else 'jsonl')
+    with open(args.manifest) as f:
+        items = manifest.read(f, format)
+
+    def progress(result):
+        kind, name, seconds, error = result
+        line = u"{0:8.3f}s {1:<10} {2}".format(seconds, kind, name)
+        if error:
+            line += u" failed: {0}".format(error)
+        print(line.encode('utf-8'))
+
+    started = time()
+    results = manifest.apply(items, args.workers, progress)
+    failed = [r for r in results if r[3]]
+    print("{0} items are done in {1:.3f}s, {2} failed".format(
+        len(results), time() - started, len(failed)))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+    koshinuke.sessions
+    ~~~~~~~~~~~~~~~~~~
+
+    Implements the stores of sessions shared by processes.
+
+    :copyright: (c) 2012 lanius
+    :license: Apache License, Version 2.0, see LICENSE for more details.
+"""
+
+import errno
+import json
+import os
+import sqlite3
+from tempfile import NamedTemporaryFile
+from threading import Thread
+from time import sleep, time
+
+from simplekv import KeyValueStore
+from simplekv.memory import DictStore
+
+
+def create_store(kind, path=None):
+    """Returns the store of sessions, `kind` is one of 'memory', 'file'
+    (files in the directory `path`) and 'sqlite' (the database `path`).
+    Only the file and sqlite stores can be shared by processes.
+    """
+    if kind == 'memory':
+        return MemoryStore()
+    elif kind == 'file':
+        return FileStore(path)
+    elif kind == 'sqlite':
+        return SQLiteStore(path)
+    raise ValueError("unknown session store: {0}".format(kind))
+
+
+def start_sweeper(store, max_age, interval):
+    """Starts a thread removing sessions which have not been saved for
+    `max_age` seconds from `store`, every `interval` seconds.
+    """
+    def sweep():
+        while True:
+            sleep(interval)
+            store.sweep(max_age)
+    sweeper = Thread(target=sweep)
+    sweeper.daemon = True
+    sweeper.start()
+    return sweeper
+
+
+def _compact(data):
+    """Reserializes the JSON of a session without whitespace."""
+    return json.dumps(json.loads(data), separators=(',', ':'))
+
+
+class MemoryStore(DictStore):
+    """Store of sessions in the memory of the process."""
+
+    def __init__(self):
+        DictStore.__init__(self)
+        self._saved = {}  # key -> time saved
+
+    def sweep(self, max_age):
+        expired = time() - max_age
+        for key, saved in self._saved.items():
+            if saved < expired:
+                self.delete(key)
+
+    def _put(self, key, data):
+        self._saved[key] = time()
+        return DictStore._put(self, key, _compact(data))
+
+    def _delete(self, key):
+        self._saved.pop(key, None)
+        return DictStore._delete(self, key)
+
+
+class FileStore(KeyValueStore):
+    """Store of sessions in files of the directory `root`, one per session.
+    A session is written to a temporary file which is renamed, so that
+    other processes never read a partially written session.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        if not os.path.isdir(root):
+            os.makedirs(root, 0700)
+
+    def iter_keys(self):
+        return (name for name in os.listdir(self.root)
+                if not name.startswith('.'))
+
+    def sweep(self, max_age):
+        expired = time() - max_age
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                if os.stat(path).st_mtime < expired:
+                    os.remove(path)
+            except OSError:  # removed by another process
+                pass
+
+    def _delete(self, key):
+        try:
+            os.remove(os.path.join(self.root, key))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def _get(self, key):
+        try:
+            with open(os.path.join(self.root, key), 'rb') as f:
+                return f.read()
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                raise KeyError(key)
+            raise
+
+    def _has_key(self, key):
+        return os.path.exists(os.path.join(self.root, key))
+
+    def _put(self, key, data):
+        with NamedTemporaryFile('wb', dir=self.root, prefix='.',
+                                delete=False) as f:
+            f.write(_compact(data))
+        os.rename(f.name, os.path.join(self.root, key))
+        return key
+
+
+class SQLiteStore(KeyValueStore):
+    """Store of sessions in the sqlite database `path`. A connection is
+    opened for each operation, so the store can be used by threads and
+    processes at once.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS sessions ('
+                         'key TEXT PRIMARY KEY, data TEXT, saved REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS sessions_saved '
+                         'ON sessions (saved)')
+
+    def iter_keys(self):
+        with self._connect() as conn:
+            keys = [row[0] for row in conn.execute('SELECT key FROM sessions')]
+        return iter(keys)
+
+    def sweep(self, max_age):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM sessions WHERE saved < ?',
+                         (time() - max_age,))
+
+    def _connect(self):
+        return _Connection(self.path)
+
+    def _delete(self, key):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM sessions WHERE key = ?', (key,))
+
+    def _get(self, key):
+        with self._connect() as conn:
+            row = conn.execute('SELECT data FROM sessions WHERE key = ?',
+                               (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return row[0].encode('utf-8')
+
+    def _has_key(self, key):
+        with self._connect() as conn:
+            return conn.execute('SELECT 1 FROM sessions WHERE key = ?',
+                                (key,)).fetchone() is not None
+
+    def _put(self, key, data):
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)',
+                         (key, _compact(data).decode('utf-8'), time()))
+        return key
+
+
+class _Connection(object):
+    """Context manager of a connection, which commits and closes it."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.conn.commit()
+        finally:
+            self.conn.close()
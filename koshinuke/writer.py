@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+    koshinuke.writer
+    ~~~~~~~~~~~~~~~~
+
+    Implements the queues serializing writes to repositories.
+
+    :copyright: (c) 2012 lanius
+    :license: Apache License, Version 2.0, see LICENSE for more details.
+"""
+
+from Queue import Queue, Empty
+from threading import Event, Lock, Thread
+
+
+class Edit(object):
+    """An edit of a file on a branch. `objectid` is the blob which the edit
+    is based on. Consecutive edits of the same branch which allow
+    `coalesce` may be committed by a single ref update.
+    """
+
+    def __init__(self, branch, path, data, message, objectid,
+                 coalesce=False):
+        self.branch = branch
+        self.path = path
+        self.data = data
+        self.message = message
+        self.objectid = objectid
+        self.coalesce = coalesce
+        self.commit = None
+        self.error = None
+        self._done = Event()
+
+    def finish(self, commit=None, error=None):
+        self.commit = commit
+        self.error = error
+        self._done.set()
+
+    def finished(self):
+        return self._done.is_set()
+
+    def wait(self):
+        self._done.wait()
+        if self.error:
+            raise self.error
+        return self.commit
+
+
+class WriteQueues(object):
+    """Queues of edits per repository. Each queue is drained by its own
+    worker thread, which passes batches of edits to `apply(key, edits)` one
+    by one. A worker exits when its queue has been idle for `idle_timeout`
+    seconds.
+    """
+
+    def __init__(self, apply, idle_timeout):
+        self.apply = apply
+        self.idle_timeout = idle_timeout
+        self.edits = 0
+        self.batches = 0
+        self._queues = {}  # key -> Queue
+        self._lock = Lock()
+
+    def submit(self, key, edit):
+        """Queues `edit`, and returns the commit of it when it is applied.
+        """
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = self._queues[key] = Queue()
+                worker = Thread(target=self._work, args=(key, queue))
+                worker.daemon = True
+                worker.start()
+            queue.put(edit)
+        return edit.wait()
+
+    def stats(self):
+        with self._lock:
+            return {'queues': len(self._queues),
+                    'edits': self.edits,
+                    'batches': self.batches}
+
+    def _work(self, key, queue):
+        while True:
+            try:
+                edits = [queue.get(timeout=self.idle_timeout)]
+            except Empty:
+                with self._lock:
+                    if queue.empty():
+                        del self._queues[key]
+                        return
+                continue
+            while True:
+                try:
+                    edits.append(queue.get_nowait())
+                except Empty:
+                    break
+            for batch in _group(edits):
+                with self._lock:
+                    self.edits += len(batch)
+                    self.batches += 1
+                try:
+                    self.apply(key, batch)
+                except Exception as e:
+                    for edit in batch:
+                        if not edit.finished():
+                            edit.finish(error=e)
+
+
+def _group(edits):
+    """Splits `edits` into batches of consecutive edits of the same branch
+    which allow to be coalesced.
+    """
+    batch = []
+    for edit in edits:
+        if batch and not (edit.coalesce and batch[-1].coalesce and
+                          edit.branch == batch[-1].branch):
+            yield batch
+            batch = []
+        batch.append(edit)
+    if batch:
+        yield batch
@@ -28,5 +28,7 @@ setup(
     kn-adduser = koshinuke.script:add_user
     kn-addproj = koshinuke.script:add_project
     kn-addrepo = koshinuke.script:add_repository
+    kn-fixperm = koshinuke.script:fix_permission
+    kn-provision = koshinuke.script:provision
     """,
 )
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.auth_benchmark
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Measures the throughput of logins against a stand-in shadow file,
+    with and without the cache of shadow entries.
+
+    Usage: python auth_benchmark.py [users] [logins]
+
+    :copyright: (c) 2012 lanius
+    :license: Apache License, Version 2.0, see LICENSE for more details.
+"""
+
+import os
+import random
+import sys
+from tempfile import NamedTemporaryFile
+from time import time
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), '..'))
+
+from koshinuke import auth
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    logins = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    with NamedTemporaryFile() as shadow:
+        for i in xrange(users):
+            password = auth._generate_encrypted_password('pass{0}'.format(i))
+            shadow.write('user{0}:{1}:15000:0:99999:7:::\n'.format(i,
+                                                                  password))
+        shadow.flush()
+
+        def load():
+            with open(shadow.name) as f:
+                return dict(line.split(':')[:2] for line in f)
+
+        # a lookup without the cache scans the file like getspnam
+        uncached = auth.ShadowCache(load, shadow.name, -1)
+        cached = auth.ShadowCache(load, shadow.name, 60)
+        for name, cache in [('uncached', uncached), ('cached', cached)]:
+            auth._backend = auth.SystemBackend(cache)
+            started = time()
+            for _ in xrange(logins):
+                i = random.randrange(users)
+                assert auth.authenticate('user{0}'.format(i),
+                                         'pass{0}'.format(i))
+            seconds = time() - started
+            print '{0:>8}: {1:.0f} logins/s ({2} loads)'.format(
+                name, logins / seconds, cache.loads)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,7 +11,9 @@
 
 import os
 import pwd
+from shutil import rmtree
 import sys
+from tempfile import mkdtemp, NamedTemporaryFile
 import unittest
 
 import utils
@@ -75,10 +77,85 @@ class AuthTestCase(unittest.TestCase):
         return True
 
 
+class ShadowCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.shadow = NamedTemporaryFile()
+        self.shadow.write('testuser:<encrypted>:15000:0:99999:7:::\n')
+        self.shadow.flush()
+        self.cache = auth.ShadowCache(self._load, self.shadow.name, 60)
+
+    def tearDown(self):
+        self.shadow.close()
+
+    def test_get(self):
+        assert self.cache.get('testuser') == '<encrypted>'
+        assert self.cache.get('invalid_user_name') is None
+        assert self.cache.stats() == {'users': 1, 'loads': 1, 'hits': 1}
+
+    def test_modified(self):
+        self.cache.get('testuser')
+        os.utime(self.shadow.name, (0, 0))
+        self.cache.get('testuser')
+        assert self.cache.loads == 2
+        self.cache.invalidate()
+        self.cache.get('testuser')
+        assert self.cache.loads == 3
+
+    def test_expired(self):
+        self.cache.ttl = -1
+        self.cache.get('testuser')
+        self.cache.get('testuser')
+        assert self.cache.loads == 2
+
+    def _load(self):
+        with open(self.shadow.name) as f:
+            return dict(line.split(':')[:2] for line in f)
+
+
+class DatabaseBackendTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.backend = auth.create_backend(
+            'database', os.path.join(self.root, 'users.db'))
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def test_authenticate(self):
+        self.backend.add_user(utils.EXPECTED_USERNAME,
+                              utils.EXPECTED_PASSWORD,
+                              utils.EXPECTED_AUTH_KEY)
+        assert self.backend.authenticate(utils.EXPECTED_USERNAME,
+                                         utils.EXPECTED_PASSWORD)
+        assert not self.backend.authenticate('invalid_user_name',
+                                             utils.EXPECTED_PASSWORD)
+        assert not self.backend.authenticate(utils.EXPECTED_USERNAME,
+                                             'invalid_password')
+        self.backend.remove_user(utils.EXPECTED_USERNAME)
+        assert not self.backend.authenticate(utils.EXPECTED_USERNAME,
+                                             utils.EXPECTED_PASSWORD)
+
+    def test_add_users(self):
+        users = [('user{0}'.format(i), 'pass{0}'.format(i), '')
+                 for i in xrange(5000)]
+        self.backend.add_users(users)
+        assert self.backend.stats() == {'users': 5000}
+        assert self.backend.authenticate('user4999', 'pass4999')
+        # none of them is added if one of them exists
+        self.assertRaises(auth.UserExistsError, self.backend.add_users,
+                          [('newuser', 'pass', ''), ('user0', 'pass', '')])
+        assert not self.backend.authenticate('newuser', 'pass')
+        assert self.backend.stats() == {'users': 5000}
+
+
 def suite():
     suite = unittest.TestSuite()
     loader = unittest.TestLoader()
     suite.addTest(loader.loadTestsFromTestCase(AuthTestCase))
+    suite.addTest(loader.loadTestsFromTestCase(ShadowCacheTestCase))
+    suite.addTest(loader.loadTestsFromTestCase(DatabaseBackendTestCase))
     return suite
 
 
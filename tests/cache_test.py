@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.cache_test
+    ~~~~~~~~~~~~~~~~
+
+    Tests caches.
+
+    :copyright: (c) 2012 lanius
+    :license: Apache License, Version 2.0, see LICENSE for more details.
+"""
+
+import os
+from shutil import rmtree
+import sys
+from tempfile import mkdtemp
+import time
+import unittest
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), '..'))
+
+from koshinuke import cache
+
+
+class DiskCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def test_get(self):
+        disk_cache = cache.DiskCache(self.root, 1024)
+        assert disk_cache.get('key') is None
+        disk_cache.set('key', 'value')
+        assert disk_cache.get('key') == 'value'
+
+    def test_evict(self):
+        disk_cache = cache.DiskCache(self.root, 1024)
+        for key in ['a', 'b', 'c']:
+            disk_cache.set(key, os.urandom(400))
+            time.sleep(0.01)  # for file systems with coarse mtime
+        assert disk_cache.get('a') is None
+        assert disk_cache.get('b') is not None
+        assert disk_cache.get('c') is not None
+
+    def test_scan(self):
+        disk_cache = cache.DiskCache(self.root, 4096)
+        for n in xrange(8):
+            disk_cache.set(str(n), os.urandom(400))
+        assert disk_cache.stats()['scans'] == 1  # only on the first write
+        disk_cache.set('8', os.urandom(1000))
+        assert disk_cache.stats()['scans'] == 2
+        assert disk_cache.stats()['size'] <= 4096 * 0.9
+        assert disk_cache.get('8') is not None
+
+
+class LRUCacheTestCase(unittest.TestCase):
+
+    def test_get(self):
+        lru_cache = cache.LRUCache(2)
+        assert lru_cache.get('a') is None
+        lru_cache.set('a', 1)
+        lru_cache.set('b', 2)
+        assert lru_cache.get('a') == 1
+        lru_cache.set('c', 3)  # 'b' is the least recently used
+        assert lru_cache.get('b') is None
+        assert lru_cache.stats()['hit_rate'] == 1.0 / 3
+
+
+class MemoryCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def test_get(self):
+        memory_cache = cache.MemoryCache(1024)
+        assert memory_cache.get('key') is None
+        memory_cache.set('key', 'value')
+        assert memory_cache.get('key') == 'value'
+        assert memory_cache.stats()['hits'] == 1
+
+    def test_evict(self):
+        memory_cache = cache.MemoryCache(1024)
+        for key in ['a', 'b', 'c']:
+            memory_cache.set(key, os.urandom(400))
+        assert memory_cache.get('a') is None
+        assert memory_cache.get('c') is not None
+
+    def test_spill(self):
+        spill = cache.DiskCache(self.root, 4096)
+        memory_cache = cache.MemoryCache(1024, spill)
+        values = dict((key, os.urandom(400)) for key in ['a', 'b', 'c'])
+        for key, value in sorted(values.items()):
+            memory_cache.set(key, value)
+        assert spill.get('a') == values['a']
+        assert memory_cache.get('a') == values['a']
+
+    def test_spill_many(self):
+        spill = cache.DiskCache(self.root, 1024 * 1024)
+        memory_cache = cache.MemoryCache(1024, spill)
+        for n in xrange(100):
+            memory_cache.set(str(n), os.urandom(400))
+        assert spill.stats()['scans'] == 1  # not per spilled entry
+        assert memory_cache.get('0') is not None
+
+
+def suite():
+    suite = unittest.TestSuite()
+    loader = unittest.TestLoader()
+    suite.addTest(loader.loadTestsFromTestCase(DiskCacheTestCase))
+    suite.addTest(loader.loadTestsFromTestCase(LRUCacheTestCase))
+    suite.addTest(loader.loadTestsFromTestCase(MemoryCacheTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.catfile_test
+    ~~~~~~~~~~~~~~~~~~
+
+    Tests the pool of cat-file processes.
+
+    :copyright: (c) 2012 lanius
+    :license: Apache License, Version 2.0, see LICENSE for more details.
+"""
+
+import os
+from StringIO import StringIO
+import sys
+from threading import Thread
+import unittest
+
+from gitdb.base import IStream
+
+import utils
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), '..'))
+
+from koshinuke.catfile import CatFilePool
+
+
+_README_SHA = 'c7821cf229cdc007aee49059281acab7753048bd'
+_README_CONTENT = 'hello koshinuke!\n'
+
+
+class CatFilePoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        utils.create_test_project()
+        utils.create_test_repository()
+        self.path = utils.get_test_repository().git_dir
+        self.pool = CatFilePool(1, 60)
+
+    def tearDown(self):
+        self.pool.close()
+        utils.destroy_test_repository()
+        utils.destroy_test_project()
+
+    def test_read(self):
+        assert self.pool.read(self.path, _README_SHA) == \
+            (_README_SHA, 'blob', _README_CONTENT)
+        assert self.pool.info(self.path, 'master:README') == \
+            (_README_SHA, 'blob', len(_README_CONTENT))
+        self.pool.read(self.path, _README_SHA)
+        assert self.pool.stats()['reused'] == 1
+
+    def test_read_missing(self):
+        self.assertRaises(KeyError, self.pool.read, self.path, '0' * 40)
+        assert self.pool.read(self.path, _README_SHA)[2] == _README_CONTENT
+
+    def test_stream(self):
+        hexsha, objtype, size, chunks = self.pool.stream(self.path,
+                                                         _README_SHA, 4)
+        assert (hexsha, objtype, size) == (_README_SHA, 'blob', 17)
+        assert list(chunks) == ['hell', 'o ko', 'shin', 'uke!', '\n']
+        assert self.pool.read(self.path, _README_SHA)[2] == _README_CONTENT
+        assert self.pool.stats()['started'] == 1
+
+    def test_stream_closed(self):
+        repo = utils.get_test_repository()
+        data = 'x' * 2 * 1024 * 1024
+        sha = repo.odb.store(IStream('blob', len(data), StringIO(data))).hexsha
+        _, _, size, chunks = self.pool.stream(self.path, sha, 100)
+        assert len(next(chunks)) == 100
+        # larger than the pipe buffer, so cat-file is blocked on writing
+        closer = Thread(target=chunks.close)
+        closer.daemon = True
+        closer.start()
+        closer.join(10)
+        assert not closer.is_alive()
+        assert self.pool.read(self.path, _README_SHA)[2] == _README_CONTENT
+        assert self.pool.stats()['started'] == 2
+
+    def test_restart(self):
+        self.pool.read(self.path, _README_SHA)
+        worker = self.pool._idle[(self.path, False)][0]
+        worker._process.kill()
+        worker._process.wait()
+        assert self.pool.read(self.path, _README_SHA)[2] == _README_CONTENT
+        assert self.pool.stats()['started'] == 2
+
+
+def suite():
+    suite = unittest.TestSuite()
+    loader = unittest.TestLoader()
+    suite.addTest(loader.loadTestsFromTestCase(CatFilePoolTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.config_test
+    ~~~~~~~~~~~~~~~~~
+
+    Tests the configuration.
+
+    :copyright: (c) 2012 lanius
+    :license: Apache License, Version 2.0, see LICENSE for more details.
+"""
+
+import os
+from shutil import rmtree
+import socket
+import sys
+from tempfile import mkdtemp
+import unittest
+
+import utils
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), '..'))
+
+from koshinuke import config
+
+
+class LazyHostTestCase(unittest.TestCase):
+
+    def setUp(self):
+        class TestConfig(object):
+            CACHE_ROOT = mkdtemp()
+            HOST_CACHE_TTL = 60
+            HOST = config.LazyHost(is_public=False)
+        self.config = TestConfig
+        self.environ = os.environ.pop('KOSHINUKE_HOST', None)
+
+    def tearDown(self):
+        rmtree(self.config.CACHE_ROOT)
+        if self.environ is not None:
+            os.environ['KOSHINUKE_HOST'] = self.environ
+
+    def test_find(self):
+        assert self.config.HOST == socket.gethostname()
+        with open(os.path.join(self.config.CACHE_ROOT, 'host')) as f:
+            assert f.read() == socket.gethostname()
+
+    def test_kept(self):
+        path = os.path.join(self.config.CACHE_ROOT, 'host')
+        with open(path, 'w') as f:
+            f.write(utils.EXPECTED_HOST)
+        assert self.config.HOST == utils.EXPECTED_HOST
+
+    def test_expired(self):
+        path = os.path.join(self.config.CACHE_ROOT, 'host')
+        with open(path, 'w') as f:
+            f.write(utils.EXPECTED_HOST)
+        os.utime(path, (0, 0))
+        assert self.config.HOST == socket.gethostname()
+
+    def test_environ(self):
+        os.environ['KOSHINUKE_HOST'] = utils.EXPECTED_HOST
+        try:
+            assert self.config.HOST == utils.EXPECTED_HOST
+        finally:
+            del os.environ['KOSHINUKE_HOST']
+        assert not os.listdir(self.config.CACHE_ROOT)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    loader = unittest.TestLoader()
+    suite.addTest(loader.loadTestsFromTestCase(LazyHostTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,10 +9,17 @@
     :license: Apache License, Version 2.0, see LICENSE for more details.
 """
 
+from hashlib import sha1
 import os
+from StringIO import StringIO
 import sys
+from tempfile import TemporaryFile
+from threading import Thread
+import time
 import unittest
 
+from gitdb.base import IStream
+
 import utils
 
 sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), '..'))
@@ -21,6 +28,12 @@ from koshinuke import core
 from koshinuke.config import Config
 
 
+_AUTHOR = {'GIT_AUTHOR_NAME': 'koshinuke',
+           'GIT_AUTHOR_EMAIL': 'koshinuke@example.com',
+           'GIT_COMMITTER_NAME': 'koshinuke',
+           'GIT_COMMITTER_EMAIL': 'koshinuke@example.com'}
+
+
 class CreateTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -44,6 +57,75 @@ class CreateTestCase(unittest.TestCase):
                                utils.EXPECTED_USERNAME)
         assert utils.exists_test_repository()
 
+    def test_create_project_database_user(self):
+        # not given to the linux user of the same name
+        auth_backend = Config.AUTH_BACKEND
+        Config.AUTH_BACKEND = 'database'
+        try:
+            core.create_project('databaseproject', 'nobody')
+        finally:
+            Config.AUTH_BACKEND = auth_backend
+        try:
+            path = os.path.join(Config.PROJECT_ROOT, 'databaseproject')
+            assert os.stat(path).st_uid == os.getuid()
+        finally:
+            utils.destroy_test_project('databaseproject')
+
+    def test_set_permission(self):
+        core.create_project(utils.EXPECTED_PROJECT, utils.EXPECTED_USERNAME)
+        core.create_repository(utils.EXPECTED_PROJECT,
+                               utils.EXPECTED_REPOSITORY,
+                               utils.EXPECTED_USERNAME)
+        path = utils.get_test_repository().git_dir
+        # git creates the entries accessible to the group
+        assert self._fix_permission() == 0
+        # the entries under the repository are not walked
+        os.chmod(os.path.join(path, 'config'), 0644)
+        core._set_permission(path, utils.EXPECTED_USERNAME)
+        assert os.stat(os.path.join(path, 'config')).st_mode & 0777 == 0644
+        # only the entries whose permission is wrong are fixed
+        assert self._fix_permission() == 1
+        assert os.stat(os.path.join(path, 'config')).st_mode & 0777 == 0660
+        # read-only objects readable by the group are accepted as they are
+        objects = os.path.join(path, 'objects')
+        name = [n for n in os.listdir(objects) if len(n) == 2][0]
+        entry = os.path.join(objects, name, os.listdir(
+            os.path.join(objects, name))[0])
+        os.chmod(entry, 0444)
+        assert self._fix_permission() == 0
+        os.chmod(entry, 0400)
+        assert self._fix_permission() == 1
+        assert os.stat(entry).st_mode & 0777 == 0440
+        self.assertRaises(core.NotFoundError, core.fix_permission,
+                          utils.EXPECTED_PROJECT, 'notexist',
+                          utils.EXPECTED_USERNAME)
+
+    def _fix_permission(self, project=utils.EXPECTED_PROJECT):
+        return core.fix_permission(project, utils.EXPECTED_REPOSITORY,
+                                   utils.EXPECTED_USERNAME)
+
+    def test_clone_remote_repository(self):
+        utils.create_test_project()
+        utils.create_test_repository()
+        uri = 'file://{0}'.format(utils.get_test_repository().git_dir)
+        job = core.clone_remote_repository(uri, None, None,
+                                           utils.EXPECTED_USERNAME)
+        assert job['target'] == '/'.join([Config.LOCAL_PROJECT,
+                                          utils.EXPECTED_REPOSITORY])
+        while job['state'] in ('queued', 'running'):
+            time.sleep(0.01)
+            job = core.get_job(job['id'])
+        try:
+            assert job['state'] == 'done'
+            assert self._fix_permission(Config.LOCAL_PROJECT) == 0
+            assert core.get_branches(Config.LOCAL_PROJECT,
+                                     utils.EXPECTED_REPOSITORY)['branches']
+            self.assertRaises(core.CanNotUpdateError,
+                              core.clone_remote_repository, uri, None, None,
+                              utils.EXPECTED_USERNAME)
+        finally:
+            utils.destroy_test_project(Config.LOCAL_PROJECT)
+
 
 class UpdateTestCase(unittest.TestCase):
 
@@ -63,6 +145,64 @@ class UpdateTestCase(unittest.TestCase):
                              content, objectid=objectid)
         assert utils.get_test_blob_content() == content
 
+    def test_update_resource_conflict(self):
+        objectid = utils.get_test_current_objectid()
+        core.update_resource(utils.EXPECTED_PROJECT, utils.EXPECTED_REPOSITORY,
+                             utils.EXPECTED_BRANCH, utils.EXPECTED_RESOURCE,
+                             'updated by test.', objectid=objectid)
+        self.assertRaises(core.CanNotUpdateError, core.update_resource,
+                          utils.EXPECTED_PROJECT, utils.EXPECTED_REPOSITORY,
+                          utils.EXPECTED_BRANCH, utils.EXPECTED_RESOURCE,
+                          'updated by another test.', objectid=objectid)
+
+    def test_update_resource_keeps_history(self):
+        objectid = utils.get_test_current_objectid()
+        core.update_resource(utils.EXPECTED_PROJECT, utils.EXPECTED_REPOSITORY,
+                             utils.EXPECTED_BRANCH, utils.EXPECTED_RESOURCE,
+                             'updated by test.', objectid=objectid)
+        commit = utils.get_test_repository().commit(utils.EXPECTED_BRANCH)
+        assert commit.parents[0].hexsha == \
+            utils.load_json('commits.json')[0]['commit']
+        assert commit.stats.files.keys() == [utils.EXPECTED_RESOURCE]
+
+    def test_update_resource_coalesced(self):
+        objectid = utils.get_test_current_objectid()
+        repo = utils.get_test_repository()
+        edits = [core.Edit(utils.EXPECTED_BRANCH, utils.EXPECTED_RESOURCE,
+                           'first', 'first', objectid, True),
+                 core.Edit(utils.EXPECTED_BRANCH, utils.EXPECTED_RESOURCE,
+                           'stale', 'stale', objectid, True),
+                 core.Edit(utils.EXPECTED_BRANCH, utils.EXPECTED_RESOURCE,
+                           'second', 'second',
+                           sha1('blob 5\0first').hexdigest(), True)]
+        core._apply_edits(repo.git_dir, edits)
+        self.assertRaises(core.CanNotUpdateError, edits[1].wait)
+        commit = repo.commit(utils.EXPECTED_BRANCH)
+        assert commit.hexsha == edits[2].wait()
+        assert commit.parents[0].hexsha == edits[0].wait()
+        assert utils.get_test_blob_content() == 'second'
+
+    def test_update_resource_shared(self):
+        repo = utils.get_test_repository()
+        repo.git.config('core.sharedRepository', '0660')
+        objectid = utils.get_test_current_objectid()
+        content = 'shared by the group.'
+        core.update_resource(utils.EXPECTED_PROJECT, utils.EXPECTED_REPOSITORY,
+                             utils.EXPECTED_BRANCH, utils.EXPECTED_RESOURCE,
+                             content, objectid=objectid)
+        blob = sha1('blob {0}\0{1}'.format(len(content), content)).hexdigest()
+        path = os.path.join(repo.git_dir, 'objects', blob[:2])
+        assert os.stat(path).st_mode & 0070 == 0070
+        assert os.stat(os.path.join(path, blob[2:])).st_mode & 0040
+
+    def test_update_resource_ref_error(self):
+        # failures other than a moved branch are not conflicts
+        repo = utils.get_test_repository()
+        edit = core.Edit('invalid..branch', utils.EXPECTED_RESOURCE,
+                         'content', 'message', None, False)
+        self.assertRaises(core.UnignorableError, core._apply_edits,
+                          repo.git_dir, [edit])
+
 
 class GetTestCase(unittest.TestCase):
 
@@ -79,8 +219,21 @@ class GetTestCase(unittest.TestCase):
         assert utils.EXPECTED_PROJECT in projects
 
     def test_get_repositories(self):
-        repositories = core.get_repositories(utils.EXPECTED_PROJECT)
-        assert utils.EXPECTED_REPOSITORY in repositories
+        path = os.path.join(Config.PROJECT_ROOT, utils.EXPECTED_PROJECT,
+                            'cloning.1.clone')
+        os.mkdir(path)
+        try:
+            repositories = core.get_repositories(utils.EXPECTED_PROJECT)
+        finally:
+            os.rmdir(path)
+        assert repositories == [utils.EXPECTED_REPOSITORY]
+
+    def test_get_all_refs(self):
+        refs = core.get_branches(utils.EXPECTED_PROJECT,
+                                 utils.EXPECTED_REPOSITORY)
+        refs.update(core.get_tags(utils.EXPECTED_PROJECT,
+                                  utils.EXPECTED_REPOSITORY))
+        assert refs in core.get_all_refs()
 
     def test_get_history(self):
         history = core.get_history(utils.EXPECTED_PROJECT,
@@ -104,6 +257,36 @@ class GetTestCase(unittest.TestCase):
         assert resource == utils.load_json('blob_rev.json')
         # todo: add test for nested resource
 
+    def test_iter_blob(self):
+        blob = core.get_blob(utils.EXPECTED_PROJECT,
+                             utils.EXPECTED_REPOSITORY,
+                             utils.EXPECTED_BRANCH,
+                             utils.EXPECTED_RESOURCE)
+        assert blob == {'objectid': utils.get_test_current_objectid(),
+                        'size': 17}
+        content = ''.join(core.iter_blob(utils.EXPECTED_PROJECT,
+                                         utils.EXPECTED_REPOSITORY,
+                                         blob['objectid']))
+        assert content == utils.get_test_blob_content()
+        content = ''.join(core.iter_blob(utils.EXPECTED_PROJECT,
+                                         utils.EXPECTED_REPOSITORY,
+                                         blob['objectid'], 6, 15))
+        assert content == utils.get_test_blob_content()[6:15]
+
+    def test_iter_blob_large(self):
+        repo = utils.get_test_repository()
+        data = 'x' * 2 * 1024 * 1024  # larger than the pipe buffer
+        objectid = repo.odb.store(IStream('blob', len(data),
+                                          StringIO(data))).hexsha
+        contents = []
+        reader = Thread(target=lambda: contents.append(''.join(
+            core.iter_blob(utils.EXPECTED_PROJECT, utils.EXPECTED_REPOSITORY,
+                           objectid, 0, 100))))
+        reader.daemon = True
+        reader.start()
+        reader.join(10)
+        assert contents == [data[:100]]
+
     def test_get_resources(self):
         resources = core.get_resources(utils.EXPECTED_PROJECT,
                                        utils.EXPECTED_REPOSITORY,
@@ -120,8 +303,17 @@ class GetTestCase(unittest.TestCase):
                                        utils.EXPECTED_BRANCH,
                                        limit=utils.EXPECTED_LIMIT)
         assert resources == utils.load_json('tree_limit.json')
+
+        resources = core.get_resources(utils.EXPECTED_PROJECT,
+                                       utils.EXPECTED_REPOSITORY,
+                                       utils.EXPECTED_BRANCH,
+                                       offset=utils.EXPECTED_LIMIT)
+        assert [r['name'] for r in resources] == ['sample.py']
+
+        self.assertRaises(core.NotFoundError, core.get_resources,
+                          utils.EXPECTED_PROJECT, utils.EXPECTED_REPOSITORY,
+                          utils.EXPECTED_BRANCH, utils.EXPECTED_RESOURCE)
         # todo: add test for nested resource
-        # todo: add test for offset
         # todo: add test for case that commit has no parent
 
     def test_get_commits(self):
@@ -148,12 +340,143 @@ class GetTestCase(unittest.TestCase):
         assert commits == utils.load_json('commits_path.json')
         # todo: add test for nested resource
 
+    def test_get_commits_cursor(self):
+        expected = utils.load_json('commits.json')
+        commits = core.get_commits(utils.EXPECTED_PROJECT,
+                                   utils.EXPECTED_REPOSITORY,
+                                   utils.EXPECTED_BRANCH,
+                                   limit=utils.EXPECTED_LIMIT)
+        cursor = core.get_next_cursor('commits', commits)
+        commits = core.get_commits(utils.EXPECTED_PROJECT,
+                                   utils.EXPECTED_REPOSITORY,
+                                   utils.EXPECTED_BRANCH,
+                                   limit=utils.EXPECTED_LIMIT, cursor=cursor)
+        assert [c['commit'] for c in commits] == [expected[1]['commit']]
+
+        self.assertRaises(core.InvalidCursorError, core.get_commits,
+                          utils.EXPECTED_PROJECT, utils.EXPECTED_REPOSITORY,
+                          utils.EXPECTED_BRANCH, cursor='invalid')
+
+    def test_get_resources_cursor(self):
+        resources = core.get_resources(utils.EXPECTED_PROJECT,
+                                       utils.EXPECTED_REPOSITORY,
+                                       utils.EXPECTED_BRANCH,
+                                       limit=utils.EXPECTED_LIMIT)
+        cursor = core.get_next_cursor('tree', resources)
+        resources = core.get_resources(utils.EXPECTED_PROJECT,
+                                       utils.EXPECTED_REPOSITORY,
+                                       utils.EXPECTED_BRANCH,
+                                       limit=utils.EXPECTED_LIMIT,
+                                       cursor=cursor)
+        assert [r['name'] for r in resources] == ['sample.py']
+
+    def test_get_branches_cursor(self):
+        branches = core.get_branches(utils.EXPECTED_PROJECT,
+                                     utils.EXPECTED_REPOSITORY,
+                                     limit=utils.EXPECTED_LIMIT)
+        assert [b['name'] for b in branches['branches']] == ['develop']
+        cursor = core.get_next_cursor('branches', branches)
+        branches = core.get_branches(utils.EXPECTED_PROJECT,
+                                     utils.EXPECTED_REPOSITORY,
+                                     limit=utils.EXPECTED_LIMIT,
+                                     cursor=cursor)
+        assert [b['name'] for b in branches['branches']] == ['master']
+
+        self.assertRaises(core.InvalidCursorError, core.get_tags,
+                          utils.EXPECTED_PROJECT, utils.EXPECTED_REPOSITORY,
+                          cursor=cursor)
+
     def test_get_commit(self):
         commit = core.get_commit(utils.EXPECTED_PROJECT,
                                  utils.EXPECTED_REPOSITORY,
                                  utils.EXPECTED_REV)
         assert commit == utils.load_json('commit.json')
 
+    def test_get_commit_truncated(self):
+        max_patch_size = Config.MAX_PATCH_SIZE
+        Config.MAX_PATCH_SIZE = 20
+        try:
+            commit = core.get_commit(utils.EXPECTED_PROJECT,
+                                     utils.EXPECTED_REPOSITORY,
+                                     utils.EXPECTED_REV)
+        finally:
+            Config.MAX_PATCH_SIZE = max_patch_size
+        assert commit['truncated']
+        assert commit['diff'][0]['patch'] == '@@ -0,0 +1 @@\n'
+        assert commit['stats']['total']['insertions'] == 1
+
+    def test_get_commit_type_changed(self):
+        # README of master is replaced by a symlink
+        repo = utils.get_test_repository()
+        target = repo.odb.store(IStream('blob', 6, StringIO('target'))).hexsha
+        entries = [line.replace('100644 blob {0}'.format(
+                                    utils.get_test_current_objectid()),
+                                '120000 blob {0}'.format(target))
+                   for line in repo.git.ls_tree('master').splitlines()]
+        tree = repo.git.mktree(istream=_file('\n'.join(entries) + '\n'))
+        rev = repo.git.commit_tree(tree, '-p', 'master', '-m', 'symlink',
+                                   env=_AUTHOR)
+        commit = core.get_commit(utils.EXPECTED_PROJECT,
+                                 utils.EXPECTED_REPOSITORY, rev)
+        assert [(d['newpath'], d['deletions'], d['insertions'])
+                for d in commit['diff']] == [(utils.EXPECTED_RESOURCE, 1, 1)]
+
+    def test_get_commit_contents(self):
+        contents = core.get_commit_contents(utils.EXPECTED_PROJECT,
+                                            utils.EXPECTED_REPOSITORY,
+                                            utils.EXPECTED_REV, 'sample.py')
+        assert contents == {'newcontent': 'print("I am koshinuke!")\n',
+                            'oldcontent': None}
+
+    def test_get_blame(self):
+        blame = core.get_blame(utils.EXPECTED_PROJECT,
+                               utils.EXPECTED_REPOSITORY,
+                               utils.EXPECTED_BRANCH,
+                               utils.EXPECTED_RESOURCE)
+        commits = utils.load_json('commits.json')
+        assert [(b['commit'], b['content']) for b in blame] == \
+            [(commits[0]['commit'], utils.get_test_blob_content().rstrip())]
+
+        self.assertRaises(core.NotFoundError, core.get_blame,
+                          utils.EXPECTED_PROJECT, utils.EXPECTED_REPOSITORY,
+                          utils.EXPECTED_BRANCH, 'invalid_path')
+
+    def test_get_stats(self):
+        core.get_commits(utils.EXPECTED_PROJECT, utils.EXPECTED_REPOSITORY,
+                         utils.EXPECTED_BRANCH)
+        hits = core.get_stats()['commits']['hits']
+        core.get_commits(utils.EXPECTED_PROJECT, utils.EXPECTED_REPOSITORY,
+                         utils.EXPECTED_BRANCH)
+        commits = core.get_stats()['commits']
+        assert commits['hits'] > hits
+        assert commits['entries'] <= Config.COMMIT_CACHE_SIZE
+
+    def test_get_blame_cached(self):
+        # blame of the parent is reused for the child
+        core.get_blame(utils.EXPECTED_PROJECT, utils.EXPECTED_REPOSITORY,
+                       utils.EXPECTED_REV, utils.EXPECTED_RESOURCE)
+        blame = core.get_blame(utils.EXPECTED_PROJECT,
+                               utils.EXPECTED_REPOSITORY,
+                               utils.EXPECTED_BRANCH,
+                               utils.EXPECTED_RESOURCE)
+        commits = utils.load_json('commits.json')
+        assert [(b['commit'], b['content']) for b in blame] == \
+            [(commits[0]['commit'], utils.get_test_blob_content().rstrip())]
+
+    def test_get_blame_cached_repeated(self):
+        # lines of the child are aligned with the parent just as git does
+        repo = utils.get_test_repository()
+        parent = _commit_file(repo, 'master', 'repeated.txt',
+                              '}\na\na\n}\na\n}\n')
+        rev = _commit_file(repo, parent, 'repeated.txt',
+                           '}\na\n}\na\na\n}\na\n')
+        core.get_blame(utils.EXPECTED_PROJECT, utils.EXPECTED_REPOSITORY,
+                       parent, 'repeated.txt')
+        blame = core.get_blame(utils.EXPECTED_PROJECT,
+                               utils.EXPECTED_REPOSITORY, rev, 'repeated.txt')
+        assert [[b['commit'], b['content']] for b in blame] == \
+            core._blame(repo.commit(rev), 'repeated.txt')
+
     def test_get_branches(self):
         branches = core.get_branches(utils.EXPECTED_PROJECT,
                                      utils.EXPECTED_REPOSITORY)
@@ -166,6 +489,22 @@ class GetTestCase(unittest.TestCase):
         assert tags == utils.load_json('tags.json')
 
 
+def _commit_file(repo, parent, path, data):
+    blob = repo.git.hash_object('-w', '--stdin', istream=_file(data))
+    entries = [line for line in repo.git.ls_tree(parent).splitlines()
+               if not line.endswith('\t' + path)]
+    entries.append('100644 blob {0}\t{1}'.format(blob, path))
+    tree = repo.git.mktree(istream=_file('\n'.join(entries) + '\n'))
+    return repo.git.commit_tree(tree, '-p', parent, '-m', path, env=_AUTHOR)
+
+
+def _file(data):
+    f = TemporaryFile()
+    f.write(data)
+    f.seek(0)
+    return f
+
+
 def suite():
     suite = unittest.TestSuite()
     loader = unittest.TestLoader()
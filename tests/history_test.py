@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.history_test
+    ~~~~~~~~~~~~~~~~~~
+
+    Tests the activity histogram.
+
+    :copyright: (c) 2012 lanius
+    :license: Apache License, Version 2.0, see LICENSE for more details.
+"""
+
+from datetime import datetime
+import json
+import os
+from shutil import rmtree
+import sys
+from tempfile import mkdtemp
+import unittest
+
+import utils
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), '..'))
+
+from koshinuke import history
+from koshinuke.cache import DiskCache
+
+
+# a moment just after the 3rd commit of the test repository
+_NOW = datetime.fromtimestamp(1325836845 + 60)
+
+
+class ActivitiesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        utils.create_test_project()
+        utils.create_test_repository()
+
+    def tearDown(self):
+        utils.destroy_test_repository()
+        utils.destroy_test_project()
+
+    def test_get_activities(self):
+        repo = utils.get_test_repository()
+        branches = repo.branches
+        activities = history.get_activities(repo, branches, 3, now=_NOW)
+        counts = dict((b.name, sum(count for _, count in a))
+                      for b, a in zip(branches, activities))
+        assert counts == {'develop': 2, 'master': 3}
+
+    def test_get_activities_out_of_range(self):
+        repo = utils.get_test_repository()
+        branches = repo.branches
+        activities = history.get_activities(repo, branches, 7)
+        for a in activities:
+            assert len(a) == 7
+            assert all(count == 0 for _, count in a)
+
+    def test_get_activities_cached(self):
+        root = mkdtemp()
+        try:
+            counts_cache = DiskCache(root, 1024 * 1024)
+            repo = utils.get_test_repository()
+            activities = history.get_activities(repo, repo.branches, 3,
+                                                now=_NOW,
+                                                counts_cache=counts_cache)
+            assert counts_cache.get(repo.git_dir)
+
+            # move 'develop' forward to the tip of 'master'
+            repo.git.update_ref('refs/heads/develop', 'master')
+            branches = repo.branches
+            activities = history.get_activities(repo, branches, 3,
+                                                now=_NOW,
+                                                counts_cache=counts_cache)
+            counts = dict((b.name, sum(count for _, count in a))
+                          for b, a in zip(branches, activities))
+            assert counts == {'develop': 3, 'master': 3}
+        finally:
+            rmtree(root)
+
+    def test_get_activities_pruned(self):
+        root = mkdtemp()
+        try:
+            counts_cache = DiskCache(root, 1024 * 1024)
+            repo = utils.get_test_repository()
+            history.get_activities(repo, repo.branches, 3, now=_NOW,
+                                   counts_cache=counts_cache)
+
+            # the cached tip was force pushed away and pruned
+            entries = json.loads(counts_cache.get(repo.git_dir))
+            entries['develop']['tip'] = '0123456789' * 4
+            counts_cache.set(repo.git_dir, json.dumps(entries))
+            branches = repo.branches
+            activities = history.get_activities(repo, branches, 3,
+                                                now=_NOW,
+                                                counts_cache=counts_cache)
+            counts = dict((b.name, sum(count for _, count in a))
+                          for b, a in zip(branches, activities))
+            assert counts == {'develop': 2, 'master': 3}
+        finally:
+            rmtree(root)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    loader = unittest.TestLoader()
+    suite.addTest(loader.loadTestsFromTestCase(ActivitiesTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
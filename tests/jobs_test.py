@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.jobs_test
+    ~~~~~~~~~~~~~~~
+
+    Tests the queue of background jobs.
+
+    :copyright: (c) 2012 lanius
+    :license: Apache License, Version 2.0, see LICENSE for more details.
+"""
+
+import os
+import sys
+import time
+import unittest
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), '..'))
+
+from koshinuke.jobs import JobQueue
+
+
+def _wait(queue, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while queue.get(job_id).state in ('queued', 'running'):
+        if time.time() > deadline:  # the worker is dead
+            break
+        time.sleep(0.01)
+    return queue.get(job_id).to_dict()
+
+
+class JobQueueTestCase(unittest.TestCase):
+
+    def test_submit(self):
+        def task(job, value):
+            job.report('Working', value)
+        queue = JobQueue(2)
+        job = queue.submit('test', 'target', task, 50)
+        status = _wait(queue, job.id)
+        assert status['state'] == 'done'
+        assert (status['phase'], status['percent']) == ('Working', 50)
+        assert queue.stats()['done'] == 1
+
+    def test_failure(self):
+        def task(job):
+            raise ValueError('broken')
+        queue = JobQueue(1)
+        job = queue.submit('test', 'target', task)
+        status = _wait(queue, job.id)
+        assert status['state'] == 'failed'
+        assert status['error'] == 'broken'
+
+    def test_failure_unicode(self):
+        def task(job, message):
+            raise ValueError(message)
+        queue = JobQueue(1)
+        for message in [u'壊れた', u'壊れた'.encode('utf-8')]:
+            job = queue.submit('test', 'target', task, message)
+            status = _wait(queue, job.id)
+            assert status['state'] == 'failed'
+            assert status['error'] == u'壊れた'
+        # the worker is still alive
+        job = queue.submit('test', 'target', lambda job: None)
+        assert _wait(queue, job.id)['state'] == 'done'
+
+    def test_history(self):
+        queue = JobQueue(1, history=1)
+        first = queue.submit('test', 'target', lambda job: None)
+        _wait(queue, first.id)
+        second = queue.submit('test', 'target', lambda job: None)
+        _wait(queue, second.id)
+        queue.submit('test', 'target', lambda job: None)
+        assert queue.get(first.id) is None
+
+
+def suite():
+    suite = unittest.TestSuite()
+    loader = unittest.TestLoader()
+    suite.addTest(loader.loadTestsFromTestCase(JobQueueTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
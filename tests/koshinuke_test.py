@@ -136,6 +136,47 @@ class AfterLoginTestCase(unittest.TestCase):
                                     utils.EXPECTED_RESOURCE]))
         assert json.loads(rv.data) == utils.load_json('blob_rev.json')
 
+    def test_raw_blob(self):
+        path = '{0}?raw=1'.format(get_path(['blob',
+                                            utils.EXPECTED_BRANCH,
+                                            utils.EXPECTED_RESOURCE]))
+        content = utils.get_test_blob_content()
+        rv = self.app.get(path)
+        assert rv.status_code == 200
+        assert rv.data == content
+        etag = rv.headers['ETag']
+
+        rv = self.app.get(path, headers={'Range': 'bytes=6-9'})
+        assert rv.status_code == 206
+        assert rv.data == content[6:10]
+        assert rv.headers['Content-Range'] == 'bytes 6-9/{0}'.format(
+            len(content))
+
+        # multiple ranges are not supported, and ignored
+        rv = self.app.get(path, headers={'Range': 'bytes=0-1,6-9'})
+        assert rv.status_code == 200
+        assert rv.data == content
+
+        rv = self.app.get(path, headers={'Range': 'bytes=100-'})
+        assert rv.status_code == 416
+
+        rv = self.app.get(path, headers={'If-None-Match': etag})
+        assert rv.status_code == 304
+
+    def test_immutable(self):
+        path = get_path(['commit', utils.EXPECTED_REV])
+        rv = self.app.get(path)
+        assert rv.status_code == 200
+        assert 'immutable' in rv.headers['Cache-Control']
+        etag = rv.headers['ETag']
+
+        assert self.app.get(path).data == rv.data
+        rv = self.app.get(path, headers={'If-None-Match': etag})
+        assert rv.status_code == 304
+
+        rv = self.app.get(get_path(['tree', utils.EXPECTED_BRANCH]))
+        assert not 'Cache-Control' in rv.headers
+
     def test_history(self):
         rv = self.app.get(get_path(['history']))
         history = json.loads(rv.data)
@@ -178,11 +219,33 @@ class AfterLoginTestCase(unittest.TestCase):
         assert utils.get_test_blob_content() == content
 
 
+class JsonifyTestCase(unittest.TestCase):
+
+    def test_jsonify_stream(self):
+        data = {u'name': u'\u30b3\u30b7\u30cc\u30b1',
+                u'items': [{u'id': n} for n in xrange(1000)]}
+        expected = koshinuke.jsonify(data).encode('utf-8')
+        data[u'items'] = (item for item in data[u'items'])
+        rv = koshinuke.jsonify_stream(data)
+        assert rv.is_streamed
+        assert ''.join(rv.response) == expected
+
+
+class ConfigTestCase(unittest.TestCase):
+
+    def test_host(self):
+        # the host is not found on import
+        assert 'HOST' not in koshinuke.app.config
+        assert koshinuke.app.config['PORT'] == Config.PORT
+
+
 def suite():
     suite = unittest.TestSuite()
     loader = unittest.TestLoader()
     suite.addTest(loader.loadTestsFromTestCase(BeforeLoginTestCase))
     suite.addTest(loader.loadTestsFromTestCase(AfterLoginTestCase))
+    suite.addTest(loader.loadTestsFromTestCase(JsonifyTestCase))
+    suite.addTest(loader.loadTestsFromTestCase(ConfigTestCase))
     return suite
 
 
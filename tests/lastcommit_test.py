@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.lastcommit_test
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Tests the index of last commits.
+
+    :copyright: (c) 2012 lanius
+    :license: Apache License, Version 2.0, see LICENSE for more details.
+"""
+
+import os
+from shutil import rmtree
+import sys
+from tempfile import mkdtemp
+import unittest
+
+import utils
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), '..'))
+
+from koshinuke import lastcommit
+from koshinuke.cache import DiskCache
+
+
+_FIRST = '77fa56bf06640565b8ca142605c0162b61f2a6e3'
+_THIRD = 'be1ec338f8dae99056f360f107a34775fda8ae62'
+
+
+class LastCommitTestCase(unittest.TestCase):
+
+    def setUp(self):
+        utils.create_test_project()
+        utils.create_test_repository()
+        self.root = mkdtemp()
+        self.index_cache = DiskCache(self.root, 1024 * 1024)
+
+    def tearDown(self):
+        rmtree(self.root)
+        utils.destroy_test_repository()
+        utils.destroy_test_project()
+
+    def test_get_last_commits(self):
+        repo = utils.get_test_repository()
+        last_commits = lastcommit.get_last_commits(
+            repo.commit(utils.EXPECTED_BRANCH))
+        assert last_commits == {'README': _THIRD,
+                                'sample.py': utils.EXPECTED_REV}
+
+        last_commits = lastcommit.get_last_commits(
+            repo.commit(utils.EXPECTED_REV))
+        assert last_commits == {'README': _FIRST,
+                                'sample.py': utils.EXPECTED_REV}
+
+    def test_get_last_commits_indexed(self):
+        repo = utils.get_test_repository()
+        expected = lastcommit.get_last_commits(
+            repo.commit(utils.EXPECTED_REV), index_cache=self.index_cache)
+        assert lastcommit.get_last_commits(
+            repo.commit(utils.EXPECTED_REV),
+            index_cache=self.index_cache) == expected
+
+        # the walk from the child stops at the indexed commit
+        last_commits = lastcommit.get_last_commits(
+            repo.commit(utils.EXPECTED_BRANCH), index_cache=self.index_cache)
+        assert last_commits == {'README': _THIRD,
+                                'sample.py': utils.EXPECTED_REV}
+
+
+def suite():
+    suite = unittest.TestSuite()
+    loader = unittest.TestLoader()
+    suite.addTest(loader.loadTestsFromTestCase(LastCommitTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
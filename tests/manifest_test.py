@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.manifest_test
+    ~~~~~~~~~~~~~~~~~~~
+
+    Tests the bulk provisioning by manifests.
+
+    :copyright: (c) 2012 lanius
+    :license: Apache License, Version 2.0, see LICENSE for more details.
+"""
+
+import os
+from StringIO import StringIO
+import sys
+import unittest
+
+import utils
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), '..'))
+
+from koshinuke import manifest
+
+
+class ReadTestCase(unittest.TestCase):
+
+    def test_read_jsonl(self):
+        f = StringIO('{"project": "p", "owner": "u"}\n'
+                     '\n'
+                     '{"project": "p", "repository": "r", "owner": "u"}\n')
+        assert manifest.read(f) == [
+            {'project': 'p', 'owner': 'u'},
+            {'project': 'p', 'repository': 'r', 'owner': 'u'}]
+
+    def test_read_csv(self):
+        f = StringIO('user,password,project,repository,owner\n'
+                     'u,secret,,,\n'
+                     ',,p,r,u\n')
+        assert manifest.read(f, 'csv') == [
+            {'user': 'u', 'password': 'secret'},
+            {'project': 'p', 'repository': 'r', 'owner': 'u'}]
+
+    def test_read_invalid(self):
+        self.assertRaises(ValueError, manifest.read,
+                          StringIO('{"repository": "r"}\n'))
+        self.assertRaises(ValueError, manifest.read, StringIO(''), 'xml')
+
+
+class ApplyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        utils.add_test_user()
+
+    def tearDown(self):
+        utils.destroy_test_project()
+        utils.remove_test_user()
+
+    def test_apply(self):
+        items = [{'project': utils.EXPECTED_PROJECT,
+                  'repository': 'repo{0}'.format(i),
+                  'owner': utils.EXPECTED_USERNAME} for i in xrange(8)]
+        items.append(items[0])  # already exists
+        results = manifest.apply(items, workers=4)
+        assert sorted(r[:2] for r in results if not r[3]) == \
+            [('project', utils.EXPECTED_PROJECT)] + \
+            [('repository', '{0}/repo{1}'.format(utils.EXPECTED_PROJECT, i))
+             for i in xrange(8)]
+        failed = [r for r in results if r[3]]
+        assert failed == [('repository', '{0}/repo0'.format(
+            utils.EXPECTED_PROJECT), 0.0, u"repository is duplicated")]
+        path = utils.get_test_repository('repo7').git_dir
+        assert os.path.isfile(os.path.join(path, 'refs', 'heads', 'master'))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    loader = unittest.TestLoader()
+    suite.addTest(loader.loadTestsFromTestCase(ReadTestCase))
+    suite.addTest(loader.loadTestsFromTestCase(ApplyTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.pool_test
+    ~~~~~~~~~~~~~~~
+
+    Tests the pool of repositories.
+
+    :copyright: (c) 2012 lanius
+    :license: Apache License, Version 2.0, see LICENSE for more details.
+"""
+
+import os
+import sys
+import time
+import unittest
+
+import utils
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), '..'))
+
+from koshinuke.pool import RepoPool
+
+
+class RepoPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        utils.create_test_project()
+        utils.create_test_repository()
+        utils.create_test_repository('otherrepo')
+        self.path = utils.get_test_repository().git_dir
+        self.other_path = utils.get_test_repository('otherrepo').git_dir
+
+    def tearDown(self):
+        utils.destroy_test_repository('otherrepo')
+        utils.destroy_test_repository()
+        utils.destroy_test_project()
+
+    def test_get(self):
+        pool = RepoPool(2)
+        repo = pool.get(self.path)
+        assert pool.get(self.path) is repo
+        assert pool.stats() == {'size': 1, 'capacity': 2,
+                                'hits': 1, 'misses': 1}
+
+    def test_evict(self):
+        pool = RepoPool(1)
+        repo = pool.get(self.path)
+        pool.get(self.other_path)
+        assert pool.get(self.path) is not repo
+        assert pool.stats()['misses'] == 3
+
+    def test_invalidate(self):
+        pool = RepoPool(2)
+        repo = pool.get(self.path)
+        time.sleep(0.01)  # for file systems with coarse mtime
+        repo.git.update_ref('refs/heads/newbranch', utils.EXPECTED_REV)
+        assert pool.get(self.path) is not repo
+
+    def test_invalidate_nested(self):
+        pool = RepoPool(2)
+        repo = pool.get(self.path)
+        repo.git.update_ref('refs/heads/feature/x', utils.EXPECTED_REV)
+        repo = pool.get(self.path)
+        time.sleep(0.01)  # for file systems with coarse mtime
+        repo.git.update_ref('refs/heads/feature/x', 'master')
+        assert pool.get(self.path) is not repo
+
+
+def suite():
+    suite = unittest.TestSuite()
+    loader = unittest.TestLoader()
+    suite.addTest(loader.loadTestsFromTestCase(RepoPoolTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
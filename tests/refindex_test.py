@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.refindex_test
+    ~~~~~~~~~~~~~~~~~~~
+
+    Tests the index of refs.
+
+    :copyright: (c) 2012 lanius
+    :license: Apache License, Version 2.0, see LICENSE for more details.
+"""
+
+import os
+import sys
+import time
+import unittest
+
+from git import Repo
+
+import utils
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), '..'))
+
+from koshinuke.config import Config
+from koshinuke.refindex import RefIndex
+
+
+def _load(path):
+    return sorted(h.name for h in Repo(path).branches)
+
+
+class RefIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        utils.create_test_project()
+        utils.create_test_repository()
+        self.index = RefIndex(_load)
+
+    def tearDown(self):
+        utils.destroy_test_repository()
+        utils.destroy_test_project()
+
+    def test_snapshot(self):
+        snapshot = self.index.snapshot(Config.PROJECT_ROOT)
+        assert (utils.EXPECTED_PROJECT, utils.EXPECTED_REPOSITORY,
+                ['develop', 'master']) in snapshot
+        self.index.snapshot(Config.PROJECT_ROOT)
+        assert self.index.stats()['loads'] == len(snapshot)
+
+    def test_update(self):
+        self.index.snapshot(Config.PROJECT_ROOT)
+        time.sleep(0.01)  # for file systems with coarse mtime
+        utils.get_test_repository().git.update_ref('refs/heads/newbranch',
+                                                   utils.EXPECTED_REV)
+        utils.create_test_repository('otherrepo')
+        try:
+            snapshot = self.index.snapshot(Config.PROJECT_ROOT)
+        finally:
+            utils.destroy_test_repository('otherrepo')
+        assert (utils.EXPECTED_PROJECT, utils.EXPECTED_REPOSITORY,
+                ['develop', 'master', 'newbranch']) in snapshot
+        assert (utils.EXPECTED_PROJECT, 'otherrepo',
+                ['develop', 'master']) in snapshot
+
+        snapshot = self.index.snapshot(Config.PROJECT_ROOT)
+        assert not [s for s in snapshot if s[1] == 'otherrepo']
+
+    def test_update_nested(self):
+        index = RefIndex(lambda path: dict((h.name, h.commit.hexsha)
+                                           for h in Repo(path).branches))
+        repo = utils.get_test_repository()
+        repo.git.update_ref('refs/heads/feature/x', utils.EXPECTED_REV)
+        index.snapshot(Config.PROJECT_ROOT)
+        time.sleep(0.01)  # for file systems with coarse mtime
+        repo.git.update_ref('refs/heads/feature/x', 'master')
+        refs = [s[2] for s in index.snapshot(Config.PROJECT_ROOT)
+                if s[1] == utils.EXPECTED_REPOSITORY][0]
+        assert refs['feature/x'] == repo.commit('master').hexsha
+
+    def test_parallel(self):
+        for n in xrange(3):
+            utils.create_test_repository('repo{0}'.format(n))
+        index = RefIndex(_load, 2)
+        scanned = []
+        try:
+            snapshot = index.snapshot(
+                Config.PROJECT_ROOT,
+                progress=lambda done, total, path, seconds:
+                scanned.append((done, total)))
+        finally:
+            for n in xrange(3):
+                utils.destroy_test_repository('repo{0}'.format(n))
+        assert len(snapshot) == len(scanned) == 4
+        assert scanned[-1] == (4, 4)
+        last_scan = index.stats()['last_scan']
+        assert last_scan['workers'] == 2
+        assert len(last_scan['slowest']) == 4
+
+
+def suite():
+    suite = unittest.TestSuite()
+    loader = unittest.TestLoader()
+    suite.addTest(loader.loadTestsFromTestCase(RefIndexTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.sessions_test
+    ~~~~~~~~~~~~~~~~~~~
+
+    Tests the stores of sessions.
+
+    :copyright: (c) 2012 lanius
+    :license: Apache License, Version 2.0, see LICENSE for more details.
+"""
+
+import os
+from shutil import rmtree
+import sys
+from tempfile import mkdtemp
+import unittest
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), '..'))
+
+from koshinuke import sessions
+
+
+class SessionStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def test_stores(self):
+        for kind in ['memory', 'file', 'sqlite']:
+            path = os.path.join(self.root, kind)
+            store = sessions.create_store(kind, path)
+            store.put('1f_4f000000', '{"username": "testuser"}')
+            assert store.get('1f_4f000000') == '{"username":"testuser"}'
+            assert '1f_4f000000' in store
+            assert list(store.keys()) == ['1f_4f000000']
+            store.delete('1f_4f000000')
+            self.assertRaises(KeyError, store.get, '1f_4f000000')
+
+    def test_shared(self):
+        for kind in ['file', 'sqlite']:
+            path = os.path.join(self.root, kind)
+            sessions.create_store(kind, path).put('1f_4f000000', '{}')
+            assert sessions.create_store(kind, path).get('1f_4f000000')
+
+    def test_sweep(self):
+        for kind in ['memory', 'file', 'sqlite']:
+            path = os.path.join(self.root, kind)
+            store = sessions.create_store(kind, path)
+            store.put('1f_4f000000', '{}')
+            store.sweep(60)
+            assert '1f_4f000000' in store
+            store.sweep(-1)  # every session is older than this
+            assert not '1f_4f000000' in store
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, sessions.create_store, 'unknown')
+
+
+def suite():
+    suite = unittest.TestSuite()
+    loader = unittest.TestLoader()
+    suite.addTest(loader.loadTestsFromTestCase(SessionStoreTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,12 +12,34 @@
 import unittest
 
 import auth_test
+import cache_test
+import catfile_test
+import config_test
 import core_test
+import history_test
+import jobs_test
+import lastcommit_test
+import manifest_test
+import pool_test
+import refindex_test
+import sessions_test
+import writer_test
 import koshinuke_test
 
 
 if __name__ == '__main__':
     alltests = unittest.TestSuite([auth_test.suite(),
+                                   cache_test.suite(),
+                                   catfile_test.suite(),
+                                   config_test.suite(),
                                    core_test.suite(),
+                                   history_test.suite(),
+                                   jobs_test.suite(),
+                                   lastcommit_test.suite(),
+                                   manifest_test.suite(),
+                                   pool_test.suite(),
+                                   refindex_test.suite(),
+                                   sessions_test.suite(),
+                                   writer_test.suite(),
                                    koshinuke_test.suite()])
     unittest.TextTestRunner(verbosity=2).run(alltests)
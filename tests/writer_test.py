@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.writer_test
+    ~~~~~~~~~~~~~~~~~
+
+    Tests the write queues.
+
+    :copyright: (c) 2012 lanius
+    :license: Apache License, Version 2.0, see LICENSE for more details.
+"""
+
+import os
+import sys
+from threading import Event, Thread
+import unittest
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), '..'))
+
+from koshinuke.writer import Edit, WriteQueues
+
+
+def _edit(branch='master', coalesce=True):
+    return Edit(branch, 'README', 'content', 'message', None, coalesce)
+
+
+class WriteQueuesTestCase(unittest.TestCase):
+
+    def test_submit(self):
+        def apply(key, edits):
+            for edit in edits:
+                edit.finish('{0}:{1}'.format(key, edit.branch))
+        queues = WriteQueues(apply, 0.1)
+        assert queues.submit('repo', _edit()) == 'repo:master'
+        assert queues.stats()['edits'] == 1
+
+    def test_error(self):
+        def apply(key, edits):
+            raise ValueError(key)
+        queues = WriteQueues(apply, 0.1)
+        self.assertRaises(ValueError, queues.submit, 'repo', _edit())
+
+    def test_coalesce(self):
+        started = Event()
+        release = Event()
+        batches = []
+
+        def apply(key, edits):
+            started.set()
+            release.wait()
+            batches.append([e.branch for e in edits])
+            for edit in edits:
+                edit.finish('commit')
+
+        queues = WriteQueues(apply, 0.1)
+        edits = [_edit(), _edit(), _edit('other'), _edit(coalesce=False)]
+        threads = [Thread(target=queues.submit, args=('repo', _edit()))]
+        threads[0].start()
+        started.wait()  # the first edit occupies the worker
+        for edit in edits:
+            queues._queues['repo'].put(edit)
+        release.set()
+        for edit in edits:
+            assert edit.wait() == 'commit'
+        threads[0].join()
+        assert batches == [['master'], ['master', 'master'],
+                           ['other'], ['master']]
+        assert queues.stats()['batches'] == 4
+
+
+def suite():
+    suite = unittest.TestSuite()
+    loader = unittest.TestLoader()
+    suite.addTest(loader.loadTestsFromTestCase(WriteQueuesTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()